@@ -6,6 +6,27 @@ This program is designed to use the ExAC VCF data from the broad institute (down
 ftp://ftp.broadinstitute.org/pub/ExAC_release
 You will first need to run the library generation function using the commandline argument -s filename.vcf
 After that, you will be able to annotate your variants using the commandline argument -f filename.txt
+Adding -p to the library split (-s filename.vcf -p) writes a packed library with one data file per chromosome and an index of where each block sits, instead of one file per block.  This is much easier on network filesystems.  Annotation detects the library format on its own.
+Adding --precompute to the library split stores the finished allele frequency values for every ExAC allele in the library, so annotation just looks them up instead of working them out from the INFO field every time.
+Adding --bloom to the library split also writes a Bloom filter of every position in ExAC.  Annotation checks it first and skips reading the library for variants at positions ExAC does not have, which is most of them in a typical exome.
+Adding --slim to the library split keeps only the parts of each ExAC line that annotation reads, which makes the library many times smaller and faster to load.
+Adding --sqlite to the library split loads ExAC into an SQLite database (subvcfs/library.sqlite) with one indexed row per allele instead of writing library files.  Several annotation runs can safely read it at the same time.
+Adding --numpy to the library split (requires NumPy) writes the library as memory mapped NumPy arrays of positions, alleles, and population counts.  Frequencies are then worked out for a whole block of ExAC alleles at once instead of one allele at a time.
+Adding --binary to the library split writes the library as a single file of fixed-size binary records, one per ExAC allele, that annotation binary searches with positioned reads instead of reading and splitting text.
+Annotation keeps recently used library blocks in memory.  The cache can be sized with --cacheblocks (number of blocks) and/or --cachemegabytes, and the hit, miss, and eviction counts are printed at the end of each run to help with sizing it.
+Adding --sharedlibrary to a run with workers loads the whole library once into shared memory, and every worker reads its blocks from there instead of from disk.
+Annotation without worker processes reads the input and writes the output on their own threads, 1000 lines at a time, so annotation is not held up by the disk.  --batchlines N changes the batch size (0 goes back to reading and writing a line at a time), --queuebatches N sets how many batches can wait between steps, and --flushbatches N sets how often the output file is flushed (0 is only at the end).
+Loci that have already been annotated are remembered (up to 100000 of them, set with --memoloci N), so a variant listed again anywhere in the file, like in a multi-sample file, is written straight out instead of being looked up again.
+Adding --annotationcache cache.sqlite keeps every finished annotation in that file, so later runs with the same library (say, re-annotating overlapping cohorts) only look up loci they have not seen before.  Annotations are only ever used with the library they came from, and several jobs can use the same file at once (even with different libraries).  Adding --purgecache clears out the annotations from every library except the one this run uses.
+Adding --prefetch N to an annotation run reads the library blocks needed by the next N input lines on background threads, so annotation rarely has to wait on the disk or network.  The hit rate is reported at the end of the run.
+Adding --profile profile.txt to annotation runs keeps a running count of which library blocks get used.  A later run with --warm profile.txt loads the most used blocks into the cache (as many as it holds) before it starts, so panels that hit the same blocks every time skip most library reads.
+Adding -w N (or --workers N) to an annotation run splits the input into chunks at library block boundaries and annotates them in N worker processes.  The output comes out in the same order as the input.
+The same -w option speeds up the library split by splitting each chromosome in its own worker process.  The library split can also be given one VCF per chromosome (-s chr1.vcf chr2.vcf ...) instead of the whole-genome VCF.
+Gzipped or BGZF-compressed files (like the .vcf.gz ExAC is distributed as) can be used directly for both the library split and annotation, without decompressing them first.
+If you have the bgzipped ExAC VCF and its tabix index (.tbi), you can skip the library split entirely and annotate with -f yourfile.txt -x ExAC.vcf.gz.  Only the parts of the VCF that your variants need get read.
+An uncompressed ExAC VCF also works with -x.  It gets memory mapped, and a small index of where records sit (saved next to it as .sparseindex) is built the first time it is used.
+The library split also writes a manifest with the size and checksum of every library file.  Annotation checks that every file is there at the right size, and adding --verify checks every checksum too.
+For small jobs, --lazyverify skips the check up front and instead checks each library block against its checksum the first time it is read, so only the blocks you use get checked.
 If you know that the integrity of the subvcf library is still good, but you it fails integrity check (this is usually an issue if you copy an already-split directory), run the program with -i to recreate the integrity check file.
 ONLY DO THIS IF YOU KNOW THAT FILES HAVEN'T BEEN LOST
 This version has not yet been tested against an ANNOVAR or VAX output, so it will probably encounter errors there.
@@ -22,8 +43,31 @@ def checkargs():  #subroutine for validating commandline arguments
     job = False
     parser = argparse.ArgumentParser()
     parser.add_argument ("-f", "--file", help = "Specify the desired file to annotate for submission.")  #tells the parser to look for -f and stuff after it and call that the filename
-    parser.add_argument ("-s", "--split", help = "Specify a VCF to split into a subVCF library for use as a reference.")
+    parser.add_argument ("-s", "--split", help = "Specify a VCF to split into a subVCF library for use as a reference.  Several per-chromosome VCFs can be given instead of one whole-genome VCF.", nargs = '+')
     parser.add_argument ("-i", "--integrity", help = "Recreate the integrity check hash.", action = 'store_true')
+    parser.add_argument ("--verify", help = "Check the checksum of every library file before annotating instead of just their names and sizes.", action = 'store_true')
+    parser.add_argument ("--lazyverify", help = "Skip checking the library before annotating and instead check each block's checksum the first time it is read.", action = 'store_true')
+    parser.add_argument ("--prefetch", help = "Number of input lines to look ahead for library blocks to read on background threads while annotating (0, the default, turns prefetching off).", type = int, default = 0)
+    parser.add_argument ("--profile", help = "Add the library blocks used on this annotation run to a usage profile file (created if needed).")
+    parser.add_argument ("--warm", help = "Load the most used library blocks from a usage profile file into the cache before annotating.")
+    parser.add_argument ("--sharedlibrary", help = "Load the whole library once into shared memory for the worker processes to read from, instead of each worker reading its own copies of blocks (use with -w).", action = 'store_true')
+    parser.add_argument ("--batchlines", help = "Number of lines the input is read and the output written in at a time, on their own threads, while annotating without worker processes (0 reads and writes one line at a time instead).  Default is 1000.", type = int, default = 1000)
+    parser.add_argument ("--queuebatches", help = "Maximum number of batches of lines waiting to be annotated or written at any time.  Default is 4.", type = int, default = 4)
+    parser.add_argument ("--flushbatches", help = "Flush the output file after this many batches have been written (0 only flushes at the end).  Default is 1.", type = int, default = 1)
+    parser.add_argument ("--memoloci", help = "Number of annotated loci to remember so that repeats of them anywhere in the file (not just on the next line) are written straight out without being looked up again (0 only reuses a locus for the line right after it).  Default is 100000.", type = int, default = 100000)
+    parser.add_argument ("--annotationcache", help = "SQLite file to keep finished annotations in from one run to the next, so loci annotated before with the same library are not looked up again (created if needed, and can be shared by jobs running at the same time).")
+    parser.add_argument ("--purgecache", help = "Delete the annotations from every other library from the annotation cache before starting (use with --annotationcache, and not while jobs using other libraries share the cache).", action = 'store_true')
+    parser.add_argument ("--cacheblocks", help = "Maximum number of library blocks to keep in memory while annotating (0 for no limit on the count; setting both cache limits to 0 turns the cache off).  Default is 256.", type = int, default = 256)
+    parser.add_argument ("--cachemegabytes", help = "Maximum megabytes of library blocks to keep in memory while annotating (0 for no limit on the size, which is the default).", type = int, default = 0)
+    parser.add_argument ("-w", "--workers", help = "Number of worker processes to use for annotation or for splitting the library.  Default is 1 (no extra processes).", type = int, default = 1)
+    parser.add_argument ("-x", "--exacvcf", help = "Annotate straight from an ExAC VCF instead of a split library (use with -f).  Either bgzipped with a tabix index (.tbi) or uncompressed (memory mapped).")
+    parser.add_argument ("--precompute", help = "Store the finished allele frequency values for every ExAC allele in the library so annotation does not have to calculate them (use with -s).", action = 'store_true')
+    parser.add_argument ("--slim", help = "Keep only the chromosome, position, alleles, and population AC/AN/Hom fields in the library, dropping the rest of the ExAC INFO data (use with -s).", action = 'store_true')
+    parser.add_argument ("-p", "--packed", help = "Write the library as one packed data file per chromosome with a block offset index instead of one file per block (use with -s).", action = 'store_true')
+    parser.add_argument ("--numpy", help = "Write the library as per-chromosome NumPy arrays of positions, alleles, and population counts, with frequencies worked out a whole block at a time (use with -s, requires NumPy).", action = 'store_true')
+    parser.add_argument ("--bloom", help = "Also write a Bloom filter of every position in ExAC so annotation can skip the library for variants at positions ExAC does not have (use with -s).", action = 'store_true')
+    parser.add_argument ("--binary", help = "Write the library as one file of sorted fixed-size binary records (one per ExAC allele) that annotation binary searches directly (use with -s).", action = 'store_true')
+    parser.add_argument ("--sqlite", help = "Load the library into an SQLite database with one row per ExAC allele instead of splitting it into files (use with -s).", action = 'store_true')
     args = parser.parse_args()  #puts the arguments into the args object
     if  args.integrity:
         if args.file or args.split:
@@ -49,11 +93,49 @@ def checkargs():  #subroutine for validating commandline arguments
     elif args.split:
         file = args.split
         job = 'librarysplit'
-        if not os.path.isfile(file):
-            quit('Specified VCF for the library split does not exist.')
+        for filename in file:
+            if not os.path.isfile(filename):
+                quit('Specified VCF for the library split does not exist: ' + filename)
         if os.path.exists('subvcfs'):
             quit('Library directory already exists.  Please remove the old one before creating a new one')
-    return (file, job)
+    if args.workers < 1:
+        quit('The number of workers must be at least 1.')
+    if args.sharedlibrary and not args.file:
+        quit('The shared library (--sharedlibrary) is used when annotating a file (-f).')
+    if args.annotationcache and not args.file:
+        quit('The annotation cache (--annotationcache) is used when annotating a file (-f).')
+    if args.purgecache and not args.annotationcache:
+        quit('Purging the annotation cache (--purgecache) needs an annotation cache (--annotationcache).')
+    if (args.profile or args.warm) and not args.file:
+        quit('Usage profiles (--profile and --warm) are used when annotating a file (-f).')
+    if args.warm and not os.path.isfile(args.warm):
+        quit('Specified usage profile does not exist.')
+    if args.prefetch < 0:
+        quit('The number of lines to prefetch cannot be negative.')
+    if args.batchlines < 0 or args.flushbatches < 0:
+        quit('Batch sizes and flush intervals cannot be negative.')
+    if args.memoloci < 0:
+        quit('The number of loci to remember cannot be negative.')
+    if args.queuebatches < 1:
+        quit('At least one batch must be allowed to wait in each queue.')
+    if args.cacheblocks < 0 or args.cachemegabytes < 0:
+        quit('Cache limits cannot be negative.')
+    if args.exacvcf:
+        if not args.file:
+            quit('An ExAC VCF to read from (-x) can only be used when annotating a file (-f).')
+        if not os.path.isfile(args.exacvcf):
+            quit('Specified ExAC VCF does not exist.')
+        if compressiontype(args.exacvcf) == 'gzip' or (compressiontype(args.exacvcf) == 'bgzf' and not os.path.isfile(args.exacvcf + '.tbi')):  #an uncompressed VCF is fine too, it gets memory mapped
+            quit('Reading straight from a compressed ExAC VCF requires a bgzipped VCF with a tabix index (' + args.exacvcf + '.tbi) next to it.')
+    if (args.verify or args.lazyverify) and not args.file:
+        quit('Library verification (--verify or --lazyverify) is done when annotating a file (-f).')
+    if args.verify and args.lazyverify:
+        quit('Please choose either --verify or --lazyverify, not both.')
+    if (args.packed or args.precompute or args.slim or args.sqlite or args.numpy or args.binary or args.bloom) and not args.split:
+        quit('The packed, precompute, slim, sqlite, numpy, binary, and bloom library options can only be used when splitting a library (-s).')
+    if len([option for option in (args.packed, args.sqlite, args.numpy, args.binary) if option]) > 1:
+        quit('Only one of the packed, sqlite, numpy, and binary library formats can be used.')
+    return (file, job, args)
 
 def usage(sin):  #This subroutine prints directions
     print ('Error: ' + sin)
@@ -73,7 +155,89 @@ def directoryhash(directory):
 def rawbytes(stringin):  #subroutine to take a string and make it into UTF-8 bytes, often for sending via socket connection
     return bytes(stringin, 'utf-8')
 
-def checkintegrity(directory):
+libraryversion = '0.8.7.1'  #the version of the library format written by this program, recorded in the manifest so annotation can tell if a library needs to be split again
+libraryblocksize = 10000  #bases per library block, also recorded in the manifest
+exacpopulations = ['AFR','AMR','EAS','FIN','NFE','SAS','OTH']  #the ExAC populations we report on.  Precomputed, SQLite, NumPy, and binary libraries store values in this order, so changing it means splitting those again
+exacdatapoints = ['AF','HOMOF']  #the values we work out and report for each population
+
+def filechecksum(filename):  #fast checksum (CRC32) of a file's contents, read in 1MB pieces so big pack or database files don't have to fit in memory
+    import zlib
+    checksum = 0
+    checkedfile = open(filename, 'rb')
+    piece = checkedfile.read(1048576)
+    while piece:
+        checksum = zlib.crc32(piece, checksum)
+        piece = checkedfile.read(1048576)
+    checkedfile.close()
+    return '%08x' % checksum
+
+def sourcefingerprint(filename):  #identifies the VCF a library was split from by its size, modification time, and a hash of its first and last megabyte, without reading the whole thing
+    import os
+    import hashlib
+    try:
+        size = os.path.getsize(filename)
+        vcf = open(filename, 'rb')
+        digest = hashlib.blake2b(vcf.read(1048576), digest_size = 16)
+        vcf.seek(max(size - 1048576, 0))
+        digest.update(vcf.read(1048576))
+        vcf.close()
+    except:
+        return False
+    return [os.path.abspath(filename), str(size), str(int(os.path.getmtime(filename))), digest.hexdigest()]
+
+def readmanifest(directory):  #reads the library manifest into a dictionary with the library version, block size, source VCF fingerprints, and a name: (size, checksum) entry for every file.  Returns False if the library has no manifest (libraries split by older versions)
+    import os
+    if not os.path.isfile(directory + '/manifest'):
+        return False
+    manifest = {'version':False, 'blocksize':False, 'sources':[], 'files':{}}
+    try:
+        manifestfile = open(directory + '/manifest', 'r')
+        for line in manifestfile:
+            entry = line.strip('\n').split('\t')
+            if entry[0] == '#version':
+                manifest['version'] = entry[1]
+            elif entry[0] == '#blocksize':
+                manifest['blocksize'] = int(entry[1])
+            elif entry[0] == '#source':
+                manifest['sources'].append(entry[1:])
+            elif len(entry) == 3:
+                manifest['files'][entry[0]] = (int(entry[1]), entry[2])
+        manifestfile.close()
+    except:
+        return False
+    return manifest
+
+def checklibraryversion(directory):  #makes sure the library was split with the block size this version uses.  Libraries without a manifest predate it, so all we can do is warn
+    manifest = readmanifest(directory)
+    if not manifest:
+        print('          ***IMPORTANT***\nIF YOU ARE USING THE LIBRARY SPLIT FROM A PREVIOUS VERSION OF THIS PROGRAM \\(BEFORE 0.8.7.1\\), YOU WILL NEED TO REDO THE SPLIT.  THE BLOCK SIZE HAS CHANGED.\n')
+        return True
+    if manifest['blocksize'] != libraryblocksize:
+        quit('The library was split by version ' + str(manifest['version']) + ' with ' + str(manifest['blocksize']) + ' base blocks, but this version uses ' + str(libraryblocksize) + ' base blocks.  Please remove the subvcfs directory and redo the split.')
+    return True
+
+def checkintegrity(directory, full = False, threads = 8):  #checks the library against its manifest.  By default this just makes sure every file is there with the right size (which catches missing, extra, and truncated files).  If full is set, every file's checksum is worked out again on a pool of threads too.  Libraries without a manifest get the old check of the file names
+    import os
+    import concurrent.futures
+    manifest = readmanifest(directory)
+    if manifest:
+        try:
+            sizes = dict([(entry.name, entry.stat().st_size) for entry in os.scandir(directory) if entry.name not in ('manifest', 'hashsum')])
+        except:
+            return False
+        problems = [name for name in manifest['files'] if name not in sizes]
+        problems += [name for name in sizes if name not in manifest['files']]
+        problems += [name for name in manifest['files'] if name in sizes and sizes[name] != manifest['files'][name][0]]
+        if not problems and full:
+            print('Verifying library checksums.')
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers = threads)  #reading the files is most of the work, so threads let several reads be in flight at once
+            names = list(manifest['files'])
+            checksums = pool.map(filechecksum, [directory + '/' + name for name in names])
+            problems = [names[i] for i, checksum in enumerate(checksums) if checksum != manifest['files'][names[i]][1]]
+            pool.shutdown()
+        for name in problems[0:10]:
+            print('Library file does not match the manifest: ' + name)
+        return not problems
     try:
         hashfile = open(directory + '/hashsum', 'r')
         recordedhash = (hashfile.readline()).strip('\n')
@@ -85,7 +249,9 @@ def checkintegrity(directory):
     else:
         return False
         
-def createintegrity(directory):
+def createintegrity(directory, sources = False, threads = 8):  #writes the library manifest (and the old name hash) for the library as it stands.  Sources is the list of VCFs the library was split from.  If it is not given (rebuilding the integrity files with -i), the sources already in the manifest are kept
+    import os
+    import concurrent.futures
     try:
         hashfile = open(directory + '/hashsum', 'w')  #opens a file to save the recorded hash at time of creation
         checksum = directoryhash(directory).hexdigest() #creates a hash of the directory filenames and saves it as checksum
@@ -95,10 +261,30 @@ def createintegrity(directory):
         hashfile.close() #and then close it
     except:  #if the process fails in some unexpected way
         return False  #return false to let the rest of the program know that
+    if sources:
+        fingerprints = [sourcefingerprint(filename) for filename in sources]
+    elif readmanifest(directory):
+        fingerprints = readmanifest(directory)['sources']
+    else:
+        fingerprints = []
+    try:
+        names = sorted([name for name in os.listdir(directory) if name not in ('manifest', 'hashsum')])
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers = threads)
+        checksums = list(pool.map(filechecksum, [directory + '/' + name for name in names]))
+        pool.shutdown()
+        manifestfile = open(directory + '/manifest', 'w')
+        manifestfile.write('#version\t' + libraryversion + '\n#blocksize\t' + str(libraryblocksize) + '\n')
+        for fingerprint in fingerprints:
+            if fingerprint:
+                manifestfile.write('#source\t' + '\t'.join(fingerprint) + '\n')
+        for i in range(0, len(names)):
+            manifestfile.write(names[i] + '\t' + str(os.path.getsize(directory + '/' + names[i])) + '\t' + checksums[i] + '\n')
+        manifestfile.close()
+    except:
+        return False
     return True  #otherwise return true to indicate success
 
-def librarysplit(filename):  #subroutine for generating the subvcf library to speed searches
-    import re  #the library we need to use regular expressions
+def librarysplit(filenames, packed = False, precompute = False, slim = False, workers = 1, sqlite = False, numpy = False, binary = False, bloom = False):  #subroutine for generating the subvcf library to speed searches.  Takes a list of VCFs (either the whole ExAC VCF or one VCF per chromosome).  If packed is set, each chromosome gets a single data file and the blocks are located through an offset index instead of getting their own files.  If precompute is set, each line gets an extra column with the finished frequency values for each of its alternate alleles.  If slim is set, only the columns and INFO fields that annotation reads are kept.  With more than one worker, the chromosomes are split in parallel.  If sqlite is set, the library goes into an SQLite database instead of files, if numpy is set, it goes into NumPy arrays, and if binary is set, it goes into a file of fixed-size binary records.  If bloom is set, a Bloom filter of all the positions in the library is written alongside it
     import os  #the library we need to look for files and directories
     if os.path.exists('subvcfs'):  #check if there is already a subvcfs directory, if so, we do not want to overwrite it
         usage('Library directory already exists.  Please remove the old one before creating a new one')
@@ -111,18 +297,97 @@ def librarysplit(filename):  #subroutine for generating the subvcf library to sp
     except:  #if we get some other error, give a message and quit
         print ('\nUnable to make the library directory.')
         quit()    
+    packindex = []  #list of [chromosome, positionblock, offset, length] entries for the packed library format (stays empty otherwise)
+    linecount = 0
+    catalog = []  #list of [blockname, bytes, lines] for every block written to a directory or packed library
+    presence = False
+    if bloom:
+        presence = {}  #the positions for the Bloom filter get gathered up here by chromosome as the library is written
+    if sqlite:  #the database only has one writer, so this always runs in this process
+        if workers > 1:
+            print('The SQLite library is built in a single process.')
+        linecount = sqlitelibrarysplit(filenames, precompute, presence)
+    elif numpy:
+        if workers > 1:
+            print('The NumPy library is built in a single process.')
+        linecount = numpylibrarysplit(filenames, presence)
+    elif binary:
+        if workers > 1:
+            print('The binary library is built in a single process.')
+        linecount = binarylibrarysplit(filenames, presence)
+    elif workers > 1:
+        import concurrent.futures
+        ranges = []
+        for filename in filenames:  #a single whole-genome VCF gets cut up at its chromosome boundaries.  Per-chromosome VCFs are already cut up for us
+            if len(filenames) == 1 and not compressiontype(filename):
+                ranges += findchromosomeboundaries(filename)
+            elif len(filenames) == 1:  #we can't jump around in a compressed file to find chromosome boundaries, so the whole thing gets split in one go
+                print('Compressed VCFs cannot be split by chromosome.  Please give per-chromosome VCFs to split compressed data in parallel.')
+                ranges.append((filename, 0, False))
+            else:
+                ranges.append((filename, 0, False))
+        print('Splitting ' + str(len(ranges)) + ' chromosome ranges with ' + str(workers) + ' worker processes.')
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers = workers)
+        threads = max(1, min(os.cpu_count() or 1, 4) // workers)  #the worker processes share the processors for decompressing between them
+        results = [pool.submit(splitrange, filename, start, end, packed, precompute, slim, False, bloom, threads) for filename, start, end in ranges]
+        packedchromosomes = set()
+        for result in results:  #collect everything in the order it was in the VCF so the index stays in order
+            rangeindex, rangelines, rangepresence, rangecatalog = result.result()
+            for chromosome in set([entry[0] for entry in rangeindex]):
+                if chromosome in packedchromosomes:  #two workers appending to the same pack file would scramble it, so chromosomes cannot be spread across different ranges
+                    pool.shutdown()
+                    quit('Chromosome ' + chromosome + ' appears in more than one of the VCFs being split.  Please give one VCF per chromosome or a single whole-genome VCF.')
+                packedchromosomes.add(chromosome)
+            packindex += rangeindex
+            linecount += rangelines
+            catalog += rangecatalog
+            mergepresence(presence, rangepresence)
+            print('Processed ' + str(linecount) + ' lines.', end = '\r')
+        pool.shutdown()
+    else:
+        for filename in filenames:
+            rangeindex, rangelines, rangepresence, rangecatalog = splitrange(filename, 0, False, packed, precompute, slim, True, bloom)
+            packindex += rangeindex
+            linecount += rangelines
+            catalog += rangecatalog
+            mergepresence(presence, rangepresence)
+    print('\n')
+    if packed and not writepackindex(packindex):  #the offset index is what lets annotation find blocks in the pack files, so a failure here means the library is useless
+        quit('Error writing the packed library index.')
+    if catalog and not writecatalog(catalog):
+        quit('Error writing the library block catalog.')
+    if bloom:
+        writepresencefilter(presence)
+    if not createintegrity('subvcfs', filenames):  #if we were not able to create the hashsum file to monitor the integrity of the library directory.  This is only done once, after every chromosome has been written
+        return False #returns a value of false to let the rest of the program know
+    return True #otherwise returns a value of true, indicating success
+
+def splitrange(filename, start, end, packed, precompute, slim, showprogress, bloom = False, threads = 0):  #splits the lines of a VCF from byte offset start up to byte offset end (or the end of the file if end is False) into the library.  Returns the pack index entries it created, the number of lines it read, (if bloom is set) the positions it saw for the Bloom filter, and the catalog entries (name, bytes, lines, and checksum) for the blocks it wrote.  This is run on its own for each chromosome when splitting in parallel, with threads limiting how many threads each one uses to decompress a BGZF VCF
     lastchromosome = 0  #initializing a bunch of values here
     linecount = 0
     libraryfile = False
     lastpositionblock = 0
+    populations = exacpopulations #the populations and datapoints for precomputed frequencies
+    datapoints = exacdatapoints
+    import zlib
+    packindex = []
+    catalog = []
+    presence = False
+    if bloom:
+        presence = {}
+    offset = start  #keeps track of where we are in the file so we know when we hit the end of our range
     try:  #see if we can open the exac VCF and read a line from it
-        exac = open(filename, 'r')
+        exac = openinputfile(filename, binary = True, threads = threads)  #opened as binary so that the byte offsets are exact
+        if start:  #only uncompressed files get cut into ranges, so we only ever need to seek in those
+            exac.seek(start)
         line = exac.readline()
     except: #otherwise, if we get an error, we display an error message and quit
         quit('Error reading from ExAC VCF')
-    while line:  #while line is not empty (indiciating we have hit the end of the file)
+    while line and (end is False or offset < end):  #while line is not empty (indiciating we have hit the end of the file) and we have not run past the end of our range
+        offset += len(line)
+        line = line.decode('utf-8')
         linecount += 1  #increment the linecount variable
-        if re.match('^\#', line):  #check if the line starts with a hashtag, indicating that it is not a data line
+        if line[0] == '#':  #check if the line starts with a hashtag, indicating that it is not a data line
             try:  #try to read the next line and then restart the loop
                 line = exac.readline()
                 continue
@@ -131,26 +396,680 @@ def librarysplit(filename):  #subroutine for generating the subvcf library to sp
         linearray = line.split('\t')  #if the line did not start with a hashtag (indicating it is a data line), we will split it at every tab
         chromosome = linearray[0] #finds the chromosome
         position = linearray[1] #finds the position
-        positionblock = str(int(position) - (int(position) % 10000)) #rounds down the position value to the nearest 100,000 bases to know which library file to use
-        if positionblock != lastpositionblock or chromosome != lastchromosome:  #if either the chromosome or position block for this variant is different from the last
-            if libraryfile:  #if we already have an open subvcf that we were writing to, we close it
-                libraryfile.close()
-            libraryfile = createlibraryfile(chromosome, positionblock) #then we create a new library file for the current chromosome and position block combination
-        try:
-            libraryfile.write(line)  #writes the data line to the subvcf.  By this point, we either know that we are writing to the same file as the last iteration, or have already opened the new one for writing
-        except:
-            quit('Error writing new library file.')  #if something goes wrong with writing, we show an error message
+        positionblock = str(int(position) - (int(position) % libraryblocksize)) #rounds down the position value to the start of its library block to know which library file to use
+        if presence is not False:
+            addpresence(presence, chromosome, int(position))
+        if slim:  #cut the line down to what annotation actually uses
+            linearray = slimlibraryline(linearray)
+            line = '\t'.join(linearray) + '\n'
+        if precompute:  #work out the frequencies once here instead of on every annotation run.  Anything past the INFO column is dropped so the precomputed values are always the ninth column
+            linearray[-1] = linearray[-1].strip('\n')
+            line = '\t'.join(linearray[0:8]) + '\t' + precomputedcolumn(linearray, populations, datapoints) + '\n'
+        if packed:  #packed libraries keep one file open per chromosome and just remember where each block starts and how long it is
+            if chromosome != lastchromosome:
+                if libraryfile:
+                    libraryfile.close()
+                libraryfile = createpackfile(chromosome)
+            if positionblock != lastpositionblock or chromosome != lastchromosome:
+                packindex.append([chromosome, positionblock, libraryfile.tell(), 0])  #start a new index entry at the current end of the pack file
+                catalog.append([chromosome + 'c' + positionblock + '.subvcf', 0, 0, 0])
+            rawline = rawbytes(line)
+            try:
+                libraryfile.write(rawline)
+            except:
+                quit('Error writing new library file.')
+            packindex[-1][3] += len(rawline)  #and grow the block length by the number of bytes we just wrote
+            catalog[-1][1] += len(rawline)
+            catalog[-1][2] += 1
+            catalog[-1][3] = zlib.crc32(rawline, catalog[-1][3])  #running checksum of the block for verifying it when it gets loaded
+        else:
+            if positionblock != lastpositionblock or chromosome != lastchromosome:  #if either the chromosome or position block for this variant is different from the last
+                if libraryfile:  #if we already have an open subvcf that we were writing to, we close it
+                    libraryfile.close()
+                libraryfile = createlibraryfile(chromosome, positionblock) #then we create a new library file for the current chromosome and position block combination
+                catalog.append([chromosome + 'c' + positionblock + '.subvcf', 0, 0, 0])
+            try:
+                libraryfile.write(line)  #writes the data line to the subvcf.  By this point, we either know that we are writing to the same file as the last iteration, or have already opened the new one for writing
+            except:
+                quit('Error writing new library file.')  #if something goes wrong with writing, we show an error message
+            rawline = rawbytes(line)
+            catalog[-1][1] += len(rawline)
+            catalog[-1][2] += 1
+            catalog[-1][3] = zlib.crc32(rawline, catalog[-1][3])
         try:
             line = exac.readline() #then we try to read the next line from the file
         except:
             quit('Error reading from ExAC VCF') #and display an error message if something goes wrong
         lastpositionblock = positionblock  #remember which chromosome and position block we were on during this iteration so we can compare with the next
         lastchromosome = chromosome
-        print('Processed ' + str(linecount) + ' lines.', end = '\r')  #and tell the user what the progress is
-    print('\n')
-    if not createintegrity('subvcfs'):  #if we were not able to create the hashsum file to monitor the integrity of the library directory
-        return False #returns a value of false to let the rest of the program know
-    return True #otherwise returns a value of true, indicating success
+        if showprogress and linecount % 10000 == 0:
+            print('Processed ' + str(linecount) + ' lines.', end = '\r')  #and tell the user what the progress is (every so often, printing every line slows things down)
+    if showprogress:
+        print('Processed ' + str(linecount) + ' lines.', end = '\r')
+    checkinputfile(exac, filename)  #a damaged compressed VCF must not turn into a library that looks complete
+    exac.close()
+    if libraryfile:
+        libraryfile.close()
+    return (packindex, linecount, presence, catalog)
+
+def sqlitecolumns(populations):  #the names of the population value columns in the SQLite library, in the order they are stored
+    columns = []
+    for datapoint in ['AC','AN','Hom']:
+        for population in populations:
+            columns.append(datapoint + '_' + population)
+    return columns
+
+def sqlitelibrarysplit(filenames, precompute, presence = False):  #loads the VCFs into an SQLite database at subvcfs/library.sqlite with one row per ExAC allele, keyed and indexed on chromosome, position, reference, and alternate allele.  The database is built under a temporary name and only moved into place once it is complete, so a reader never sees a half-built library.  Returns the number of lines read
+    import os
+    import sqlite3
+    populations = exacpopulations
+    datapoints = exacdatapoints
+    columns = sqlitecolumns(populations)
+    temporaryname = 'subvcfs/library.sqlite.tmp'
+    insert = 'INSERT INTO variants VALUES (' + ','.join(['?'] * (len(columns) + 7)) + ')'
+    try:
+        connection = sqlite3.connect(temporaryname)
+        connection.execute('CREATE TABLE variants (chrom TEXT, pos INTEGER, ref TEXT, alt TEXT, line INTEGER, allele INTEGER, ' + ' INTEGER, '.join(columns) + ' INTEGER, precomputed TEXT)')  #line and allele keep track of which VCF line each allele came from so blocks can be put back together in their original order
+    except:
+        quit('Error creating the SQLite library.')
+    linecount = 0
+    vcfline = 0
+    rows = []
+    for filename in filenames:
+        try:
+            exac = openinputfile(filename)
+        except:
+            quit('Error reading from ExAC VCF')
+        for line in exac:
+            linecount += 1
+            if line[0] == '#' or not line.strip():
+                continue
+            vcfline += 1
+            if presence is not False:
+                addpresence(presence, line.split('\t', 1)[0], int(line.split('\t', 2)[1]))
+            rows += sqliterows(line.strip('\n').split('\t'), vcfline, populations, datapoints, columns, precompute)
+            if len(rows) >= 10000:  #insert in batches instead of one row at a time
+                connection.executemany(insert, rows)
+                rows = []
+            if linecount % 10000 == 0:
+                print('Processed ' + str(linecount) + ' lines.', end = '\r')
+        checkinputfile(exac, filename)
+        exac.close()
+    try:
+        connection.executemany(insert, rows)
+        connection.execute('CREATE INDEX variantkey ON variants (chrom, pos, ref, alt)')  #building the index once at the end is much faster than keeping it up to date through every insert
+        connection.commit()
+        connection.close()
+        os.replace(temporaryname, 'subvcfs/library.sqlite')
+    except:
+        quit('Error writing the SQLite library.')
+    print('Processed ' + str(linecount) + ' lines.', end = '\r')
+    return linecount
+
+def sqliterows(linearray, vcfline, populations, datapoints, columns, precompute):  #turns a split ExAC line into one database row per alternate allele.  AN values are the same for every allele, AC and Hom values get split up between them
+    alts = linearray[4].split(',')
+    infohash = {}
+    for field in linearray[7].split(';'):
+        key, equals, value = field.partition('=')
+        infohash[key] = value
+    if precompute:
+        precomputed = precomputedcolumn(linearray, populations, datapoints)[len('ExACto='):].split('|')  #one segment per alternate allele
+    rows = []
+    for i in range(0, len(alts)):
+        rows.append([linearray[0], int(linearray[1]), linearray[3], alts[i], vcfline, i])
+    for column in columns:
+        if column not in infohash:
+            for row in rows:
+                row.append(None)
+            continue
+        values = infohash[column].split(',')
+        for i in range(0, len(rows)):
+            if column.startswith('AN_'):
+                rows[i].append(infohash[column])
+            elif len(values) == len(alts):
+                rows[i].append(values[i])
+            elif i == 0:  #a value that doesn't split evenly between the alleles is kept whole on the first one so it comes back out unchanged
+                rows[i].append(infohash[column])
+            else:
+                rows[i].append(None)
+    for i in range(0, len(rows)):
+        if precompute:
+            rows[i].append(precomputed[i])
+        else:
+            rows[i].append(None)
+    return rows
+
+def readsqliteregion(libraryinfo, chromosome, start, end):  #returns an indexed block of library lines for a chromosome with positions from start up to (not including) end, put together from the rows of the SQLite library, or False if there are none.  The finished values for each allele come from its precomputed values if the library has them, or otherwise straight from its count columns, so no INFO field is built or parsed
+    columns = libraryinfo['columns']
+    try:
+        rows = libraryinfo['connection'].execute('SELECT chrom, pos, ref, alt, line, precomputed, ' + ', '.join(columns) + ' FROM variants WHERE chrom = ? AND pos >= ? AND pos < ? ORDER BY line, allele', (chromosome, start, end)).fetchall()  #one indexed range query gets the whole block
+    except:
+        quit('Error reading from the SQLite library.')
+    if not rows:
+        return False
+    lines = []
+    linerows = [rows[0]]
+    for row in rows[1:] + [False]:  #gather up the rows for each VCF line and make the line once we have all of them
+        if row and row[4] == linerows[0][4]:
+            linerows.append(row)
+            continue
+        if linerows[0][5] is not None:
+            values = parseprecomputed('ExACto=' + '|'.join([linerow[5] for linerow in linerows]))
+        else:
+            values = [countvalues(linerow[6:6 + len(columns)], columns, linerow[0]) for linerow in linerows]
+        lines.append([linerows[0][0], str(linerows[0][1]), '.', linerows[0][2], ','.join([linerow[3] for linerow in linerows]), '.', '.', '.', values])
+        linerows = [row]
+    return recordblock(lines)
+
+def importnumpy():  #NumPy is only needed for the NumPy library format, so we only go looking for it when that format is used
+    try:
+        import numpy
+    except ImportError:
+        quit('The NumPy library format requires NumPy to be installed.')
+    return numpy
+
+def numpylibrarysplit(filenames, presence = False):  #writes the library as a set of NumPy arrays for each chromosome: the position of each ExAC line, where each line's alleles start in the other arrays, the reference and alternate alleles as text, and a count matrix of AC, AN, and Hom for each population for each allele (-1 where ExAC has no value).  Returns the number of lines read
+    import array
+    numpy = importnumpy()
+    populations = exacpopulations
+    columns = sqlitecolumns(populations)  #AC, AN, and Hom for each population, the same values the SQLite library keeps
+    chromosomes = []
+    chromosome = False
+    linecount = 0
+    for filename in filenames:
+        try:
+            exac = openinputfile(filename)
+        except:
+            quit('Error reading from ExAC VCF')
+        for line in exac:
+            linecount += 1
+            if line[0] == '#' or not line.strip():
+                continue
+            linearray = line.strip('\n').split('\t')
+            if linearray[0] != chromosome:  #new chromosome, so we save the arrays for the last one and start over
+                if chromosome:
+                    writenumpychromosome(numpy, chromosome, arrays, len(populations))
+                chromosome = linearray[0]
+                if chromosome in chromosomes:
+                    quit('Chromosome ' + chromosome + ' is not all together in the VCFs being split.  The NumPy library needs each chromosome in one piece.')
+                chromosomes.append(chromosome)
+                arrays = {'positions':array.array('q'), 'siterows':array.array('q', [0]), 'counts':array.array('q'), 'alleles':bytearray(), 'alleleoffsets':array.array('q', [0])}
+            arrays['positions'].append(int(linearray[1]))
+            if presence is not False:
+                addpresence(presence, chromosome, int(linearray[1]))
+            alleletext = (linearray[3] + '\t' + linearray[4] + '\n').encode('utf-8')
+            arrays['alleles'] += alleletext
+            arrays['alleleoffsets'].append(arrays['alleleoffsets'][-1] + len(alleletext))
+            for row in sqliterows(linearray, 0, populations, False, columns, False):  #one row of counts per alternate allele, split up the same way as for the SQLite library
+                for population in range(0, len(populations)):
+                    for datapoint in range(0, 3):  #the count matrix is allele by population by AC/AN/Hom
+                        value = row[6 + datapoint * len(populations) + population]
+                        try:
+                            arrays['counts'].append(int(value))
+                        except (TypeError, ValueError):
+                            arrays['counts'].append(-1)
+            arrays['siterows'].append(arrays['siterows'][-1] + len(linearray[4].split(',')))
+            if linecount % 10000 == 0:
+                print('Processed ' + str(linecount) + ' lines.', end = '\r')
+        checkinputfile(exac, filename)
+        exac.close()
+    if chromosome:
+        writenumpychromosome(numpy, chromosome, arrays, len(populations))
+    try:
+        indexfile = open('subvcfs/numpyindex', 'w')  #the list of chromosomes also tells annotation that this is a NumPy library
+        for chromosome in chromosomes:
+            indexfile.write(chromosome + '\n')
+        indexfile.close()
+    except:
+        quit('Error writing the NumPy library index.')
+    print('Processed ' + str(linecount) + ' lines.', end = '\r')
+    return linecount
+
+def writenumpychromosome(numpy, chromosome, arrays, populationcount):  #saves the arrays built up for a chromosome as .npy files in the library directory
+    try:
+        numpy.save('subvcfs/' + chromosome + '.positions.npy', numpy.frombuffer(arrays['positions'], dtype = numpy.int64))
+        numpy.save('subvcfs/' + chromosome + '.siterows.npy', numpy.frombuffer(arrays['siterows'], dtype = numpy.int64))
+        numpy.save('subvcfs/' + chromosome + '.counts.npy', numpy.frombuffer(arrays['counts'], dtype = numpy.int64).reshape(-1, populationcount, 3))
+        numpy.save('subvcfs/' + chromosome + '.alleles.npy', numpy.frombuffer(bytes(arrays['alleles']), dtype = numpy.uint8))
+        numpy.save('subvcfs/' + chromosome + '.alleleoffsets.npy', numpy.frombuffer(arrays['alleleoffsets'], dtype = numpy.int64))
+    except:
+        quit('Error writing NumPy library files for chromosome ' + chromosome)
+
+def loadnumpychromosome(libraryinfo, chromosome):  #memory maps the arrays for a chromosome the first time it is needed.  Returns False if the library has nothing for that chromosome
+    if chromosome not in libraryinfo['arrays']:
+        if chromosome not in libraryinfo['index']:
+            libraryinfo['arrays'][chromosome] = False
+        else:
+            arrays = {}
+            try:
+                for name in ['positions', 'siterows', 'counts', 'alleles', 'alleleoffsets']:
+                    arrays[name] = libraryinfo['numpy'].load(libraryinfo['directory'] + '/' + chromosome + '.' + name + '.npy', mmap_mode = 'r')
+            except:
+                quit('Error reading NumPy library files for chromosome ' + chromosome)
+            libraryinfo['arrays'][chromosome] = arrays
+    return libraryinfo['arrays'][chromosome]
+
+def numpyallelevalues(numpy, counts, chromosome, datapoints, populations):  #the vectorised version of getallelevalues: takes the allele by population by AC/AN/Hom count matrix for a batch of alleles and returns a list of value lists (one per allele), with the same values and types that getallelevalues gives (0 where ExAC has no value, NA where there was no coverage)
+    ac = counts[:,:,0]
+    an = counts[:,:,1]
+    hom = counts[:,:,2]
+    results = []
+    with numpy.errstate(divide = 'ignore', invalid = 'ignore'):  #the zero coverage cases get replaced with NA below
+        for point in datapoints:
+            if point == 'AF':
+                missing = (ac < 0) | (an < 0)
+                frequencies = ac / an
+            elif point == 'HOMOF':
+                missing = (hom < 0) | (an < 0)
+                frequencies = hom / (an / 2)
+            nocoverage = (an == 0) & ~missing
+            if point == 'HOMOF' and chromosome in ('X','x','Y','y','MT','Mt','mt'):  #no homozygous frequencies off the autosomes (see getallelevalues)
+                nocoverage = numpy.ones(an.shape, dtype = bool)
+                missing = numpy.zeros(an.shape, dtype = bool)
+            maximums = numpy.where(missing | nocoverage, 0.0, frequencies).max(axis = 1)
+            results.append((frequencies.tolist(), missing.tolist(), nocoverage.tolist(), maximums.tolist()))
+    allelevalues = []
+    for i in range(0, counts.shape[0]):  #now turn the arrays back into plain python values for output
+        values = []
+        for frequencies, missing, nocoverage, maximums in results:
+            for j in range(0, len(populations)):
+                if missing[i][j]:
+                    values.append(0)
+                elif nocoverage[i][j]:
+                    values.append('NA')
+                else:
+                    values.append(frequencies[i][j])
+            if maximums[i] > 0:
+                values.append(maximums[i])
+            else:
+                values.append(0)  #getallelevalues starts its maximum at 0 and only replaces it with something bigger
+        allelevalues.append(values)
+    return allelevalues
+
+def readnumpyregion(libraryinfo, chromosome, start, end):  #returns an indexed block of library lines for a chromosome with positions from start up to (not including) end out of the NumPy library, or False if there are none.  The frequencies for every allele in the region are worked out in one vectorised step and go straight into the lines as value lists, so nothing is turned into text and parsed again
+    arrays = loadnumpychromosome(libraryinfo, chromosome)
+    if not arrays:
+        return False
+    numpy = libraryinfo['numpy']
+    first, last = numpy.searchsorted(arrays['positions'], [start, end]).tolist()  #binary search for the sites in the region
+    if first == last:
+        return False
+    firstrow = int(arrays['siterows'][first])
+    siterows = (arrays['siterows'][first:last + 1] - firstrow).tolist()
+    allelevalues = numpyallelevalues(numpy, numpy.asarray(arrays['counts'][firstrow:int(arrays['siterows'][last])]), chromosome, exacdatapoints, exacpopulations)
+    alleles = arrays['alleles'][int(arrays['alleleoffsets'][first]):int(arrays['alleleoffsets'][last])].tobytes().decode('utf-8').split('\n')
+    positions = arrays['positions'][first:last].tolist()
+    lines = []
+    for i in range(0, last - first):
+        reference, alternates = alleles[i].split('\t')
+        lines.append([chromosome, str(positions[i]), '.', reference, alternates, '.', '.', '.', allelevalues[siterows[i]:siterows[i + 1]]])
+    return recordblock(lines)
+
+binaryrecord = '<HHI21IQI'  #layout of a binary library record: chromosome number, allele number on its ExAC line, position, AC/AN/Hom counts for each population (in sqlitecolumns order), and the offset and length of the allele text in the side file
+binarymissing = 4294967295  #stands in for a count that ExAC does not have
+
+def binarylibrarysplit(filenames, presence = False):  #writes the library as a file of fixed-size records (subvcfs/library.records), one for each ExAC allele and sorted by chromosome and position, with the allele text in a side file (subvcfs/library.alleles) and the chromosome numbering in subvcfs/recordindex.  Returns the number of lines read
+    import struct
+    populations = exacpopulations
+    columns = sqlitecolumns(populations)
+    chromosomes = []
+    lastposition = 0
+    linecount = 0
+    try:
+        recordfile = open('subvcfs/library.records', 'wb')
+        allelefile = open('subvcfs/library.alleles', 'wb')
+    except:
+        quit('Error creating new library file.')
+    alleleoffset = 0
+    for filename in filenames:
+        try:
+            exac = openinputfile(filename)
+        except:
+            quit('Error reading from ExAC VCF')
+        for line in exac:
+            linecount += 1
+            if line[0] == '#' or not line.strip():
+                continue
+            linearray = line.strip('\n').split('\t')
+            if not chromosomes or linearray[0] != chromosomes[-1]:
+                if linearray[0] in chromosomes:
+                    quit('Chromosome ' + linearray[0] + ' is not all together in the VCFs being split.  The binary library needs each chromosome in one piece.')
+                chromosomes.append(linearray[0])
+                lastposition = 0
+            if int(linearray[1]) < lastposition:  #the records get binary searched, so they have to go in sorted
+                quit('The VCF is not sorted by position on chromosome ' + linearray[0] + '.  The binary library needs a sorted VCF.')
+            lastposition = int(linearray[1])
+            if presence is not False:
+                addpresence(presence, linearray[0], lastposition)
+            records = b''
+            for row in sqliterows(linearray, 0, populations, False, columns, False):  #one record per alternate allele, with the counts split up the same way as for the SQLite library
+                counts = []
+                for value in row[6:6 + len(columns)]:
+                    try:
+                        counts.append(int(value))
+                    except (TypeError, ValueError):
+                        counts.append(binarymissing)
+                alleletext = (row[2] + '\t' + row[3]).encode('utf-8')
+                records += struct.pack(binaryrecord, len(chromosomes) - 1, row[5], row[1], *counts, alleleoffset, len(alleletext))
+                try:
+                    allelefile.write(alleletext)
+                except:
+                    quit('Error writing new library file.')
+                alleleoffset += len(alleletext)
+            try:
+                recordfile.write(records)
+            except:
+                quit('Error writing new library file.')
+            if linecount % 10000 == 0:
+                print('Processed ' + str(linecount) + ' lines.', end = '\r')
+        checkinputfile(exac, filename)
+        exac.close()
+    recordfile.close()
+    allelefile.close()
+    try:
+        indexfile = open('subvcfs/recordindex', 'w')  #chromosome names in the order of their numbers.  This also tells annotation that this is a binary library
+        for chromosome in chromosomes:
+            indexfile.write(chromosome + '\n')
+        indexfile.close()
+    except:
+        quit('Error writing the binary library index.')
+    print('Processed ' + str(linecount) + ' lines.', end = '\r')
+    return linecount
+
+def findbinaryrecord(libraryinfo, chromosomenumber, position):  #binary search of the record file for the first record at or past a chromosome and position, reading just the key of each record we look at with a positioned read
+    import os
+    import struct
+    low = 0
+    high = libraryinfo['recordcount']
+    while low < high:
+        middle = (low + high) // 2
+        chromosome, allele, middleposition = struct.unpack_from('<HHI', os.pread(libraryinfo['records'], 8, middle * libraryinfo['recordsize']))
+        if (chromosome, middleposition) < (chromosomenumber, position):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+def readbinaryregion(libraryinfo, chromosome, start, end):  #returns an indexed block of library lines for a chromosome with positions from start up to (not including) end out of the binary record file, or False if there are none.  The counts come straight out of the records into the finished values for each allele, so nothing is turned into text and parsed again
+    import os
+    import struct
+    if chromosome not in libraryinfo['index']:
+        return False
+    chromosomenumber = libraryinfo['index'][chromosome]
+    first = findbinaryrecord(libraryinfo, chromosomenumber, start)
+    last = findbinaryrecord(libraryinfo, chromosomenumber, end)
+    if first == last:
+        return False
+    try:
+        data = os.pread(libraryinfo['records'], (last - first) * libraryinfo['recordsize'], first * libraryinfo['recordsize'])  #the records for the whole region are next to each other, so one read gets all of them
+        records = list(struct.iter_unpack(binaryrecord, data))
+        allelestart = records[0][-2]
+        alleletext = os.pread(libraryinfo['alleles'], records[-1][-2] + records[-1][-1] - allelestart, allelestart)  #and so is their allele text
+    except:
+        quit('Error reading binary library file.')
+    columns = libraryinfo['columns']
+    lines = []
+    for record in records:
+        reference, alternate = alleletext[record[-2] - allelestart:record[-2] - allelestart + record[-1]].decode('utf-8').split('\t')
+        values = countvalues(record[3:3 + len(columns)], columns, chromosome, binarymissing)
+        if record[1] == 0:  #the first allele of an ExAC line starts a new library line
+            lines.append([chromosome, str(record[2]), '.', reference, [alternate], '.', '.', '.', [values]])
+        else:
+            lines[-1][4].append(alternate)
+            lines[-1][8].append(values)
+    if not lines:
+        return False
+    for line in lines:
+        line[4] = ','.join(line[4])
+    return recordblock(lines)
+
+def addpresence(presence, chromosome, position):  #remembers a position for the Bloom filter.  Positions come in sorted order, so a repeat of the last position on the chromosome is all we need to skip
+    import array
+    if chromosome not in presence:
+        presence[chromosome] = array.array('l')
+    if not presence[chromosome] or presence[chromosome][-1] != position:
+        presence[chromosome].append(position)
+
+def mergepresence(presence, rangepresence):  #adds the positions gathered for one part of the split to the ones for the whole library
+    if presence is False or not rangepresence:
+        return
+    for chromosome in rangepresence:
+        if chromosome in presence:
+            presence[chromosome] += rangepresence[chromosome]
+        else:
+            presence[chromosome] = rangepresence[chromosome]
+
+def presencebits(chromosome, position, bitcount, hashcount):  #the bits of the Bloom filter that stand for a chromosome and position.  Two 64 bit hashes from a single digest get combined to make as many as we need
+    import hashlib
+    digest = hashlib.blake2b((chromosome + ':' + str(position)).encode('utf-8'), digest_size = 16).digest()
+    first = int.from_bytes(digest[0:8], 'little')
+    second = int.from_bytes(digest[8:16], 'little') | 1
+    return [(first + i * second) % bitcount for i in range(0, hashcount)]
+
+def writepresencefilter(presence, falsepositiverate = 0.01):  #builds a Bloom filter of every chromosome and position in the library and writes it to subvcfs/presence.bloom.  The filter is sized for about 1 false positive in 100 positions that are not in ExAC
+    import math
+    import struct
+    positioncount = max(sum([len(positions) for positions in presence.values()]), 1)
+    bitcount = max(int(-positioncount * math.log(falsepositiverate) / (math.log(2) ** 2)), 64)
+    hashcount = max(int(round(bitcount / positioncount * math.log(2))), 1)
+    bits = bytearray((bitcount + 7) // 8)
+    for chromosome in presence:
+        for position in presence[chromosome]:
+            for bit in presencebits(chromosome, position, bitcount, hashcount):
+                bits[bit >> 3] |= 1 << (bit & 7)
+    try:
+        filterfile = open('subvcfs/presence.bloom', 'wb')
+        filterfile.write(struct.pack('<4sQI', b'EXBF', bitcount, hashcount))
+        filterfile.write(bits)
+        filterfile.close()
+    except:
+        quit('Error writing the Bloom filter.')
+
+def loadpresencefilter(filename):  #reads a Bloom filter written by writepresencefilter and returns a dictionary with its bits and settings
+    import struct
+    try:
+        filterfile = open(filename, 'rb')
+        data = filterfile.read()
+        filterfile.close()
+    except:
+        quit('Error reading the Bloom filter.')
+    tag, bitcount, hashcount = struct.unpack_from('<4sQI', data)
+    if tag != b'EXBF':
+        quit('The Bloom filter in the library directory does not look right.  Please redo the library split.')
+    return {'bits':data[struct.calcsize('<4sQI'):], 'bitcount':bitcount, 'hashcount':hashcount}
+
+def checkpresence(presencefilter, chromosome, position):  #returns False if ExAC definitely has nothing at this chromosome and position, True if it might
+    bits = presencefilter['bits']
+    for bit in presencebits(chromosome, position, presencefilter['bitcount'], presencefilter['hashcount']):
+        if not bits[bit >> 3] & (1 << (bit & 7)):
+            return False
+    return True
+
+def compressiontype(filename):  #looks at the first bytes of a file to see if it is gzipped, and if so, whether it is BGZF (blocked gzip, the way ExAC and tabix files are compressed).  Returns 'bgzf', 'gzip', or False for an uncompressed file
+    try:
+        checkfile = open(filename, 'rb')
+        header = checkfile.read(14)
+        checkfile.close()
+    except:
+        return False
+    if header[0:2] != b'\x1f\x8b':  #the gzip magic number
+        return False
+    if len(header) >= 14 and header[3] & 4 and header[12:14] == b'BC':  #BGZF sets the extra field flag and puts a BC subfield at the start of it
+        return 'bgzf'
+    return 'gzip'
+
+decompressionerrors = {}  #errors from the background decompression threads, by the file descriptor of the pipe they were feeding.  The reader only sees the pipe close, so it has to look here to tell a damaged file from the real end of one
+decompressionpipes = set()  #write ends of the pipes the decompression threads are still feeding
+
+def openinputfile(filename, binary = False, threads = 0):  #opens a file for reading whether or not it is compressed.  Compressed files are decompressed on a background thread and fed through a pipe, so decompression overlaps with whatever we are doing with the lines.  Threads is how many threads can inflate BGZF blocks (0 to pick for ourselves)
+    import os
+    import threading
+    if not compressiontype(filename):
+        if binary:
+            return open(filename, 'rb')
+        return open(filename, 'r')
+    readend, writeend = os.pipe()
+    decompressionerrors.pop(readend, None)  #anything left over from an earlier pipe that used the same descriptor
+    decompressionpipes.add(writeend)
+    if compressiontype(filename) == 'bgzf':  #BGZF blocks can be inflated independently, so those get spread over a pool of threads
+        decompressor = threading.Thread(target = decompressbgzfinbackground, args = (filename, readend, writeend, threads), daemon = True)
+    else:
+        decompressor = threading.Thread(target = decompressinbackground, args = (filename, readend, writeend), daemon = True)  #daemon thread so that it never holds the program open if we quit early
+    decompressor.start()
+    if binary:
+        return os.fdopen(readend, 'rb')
+    return os.fdopen(readend, 'r')
+
+def checkinputfile(inputfile, filename):  #quits if the file we just finished reading was cut short because it could not be decompressed.  This needs to be called once the reading is done and before the file is closed
+    error = decompressionerrors.pop(inputfile.fileno(), False)
+    if error:
+        quit('Error decompressing ' + filename + ': ' + error)
+    return True
+
+def closedecompressionpipes():  #runs in a newly started worker process to close the copies it got of the decompression pipes' write ends.  As long as any process holds one open, the reader never sees the end of the file
+    import os
+    for writeend in decompressionpipes:
+        try:
+            os.close(writeend)
+        except OSError:
+            pass
+    decompressionpipes.clear()
+
+def decompressinbackground(filename, readend, writeend):  #runs on a background thread: decompresses a gzip or BGZF file into the write end of a pipe.  Any error is left in decompressionerrors for the reader to find
+    import gzip
+    import os
+    pipe = os.fdopen(writeend, 'wb')
+    try:
+        source = gzip.open(filename, 'rb')  #BGZF is just a series of gzip members, which the gzip module reads straight through
+        tail = b''
+        chunk = source.read(1048576)
+        while chunk:
+            tail = writecompletelines(pipe, tail + chunk)
+            chunk = source.read(1048576)
+        pipe.write(tail)  #the file ended properly, so whatever was after the last line break is real too
+        source.close()
+    except BrokenPipeError:  #whoever was reading stopped early, so there is nobody to send the rest to
+        pass
+    except Exception as error:
+        decompressionerrors[readend] = str(error)  #the reader will just see the file end early, so this has to be in place before the pipe closes
+    decompressionpipes.discard(writeend)
+    try:
+        pipe.close()  #closing the pipe is what tells the reader it has hit the end of the file
+    except BrokenPipeError:
+        pass
+
+def decompressbgzfinbackground(filename, readend, writeend, threads = 0):  #runs on a background thread: reads a BGZF file one block at a time, inflates the blocks on a pool of threads (zlib lets go of the interpreter lock while it works, so they really do run at the same time), and writes them to the pipe in their original order.  If threads is 0, up to 4 are used
+    import os
+    import collections
+    import concurrent.futures
+    if not threads:
+        threads = min(os.cpu_count() or 1, 4)  #one thread writes everything to the pipe, so more inflating threads than this just sit waiting on it
+    pipe = os.fdopen(writeend, 'wb')
+    try:
+        source = open(filename, 'rb')
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers = threads)
+        pending = collections.deque()  #blocks being inflated, in file order
+        tail = b''
+        block = readbgzfblock(source)
+        while block or pending:
+            while block and len(pending) < threads * 4:  #keep a few blocks in flight for each thread without reading the whole file into memory
+                pending.append(pool.submit(inflatebgzfblock, block))
+                block = readbgzfblock(source)
+            tail = writecompletelines(pipe, tail + pending.popleft().result())
+        pipe.write(tail)
+        pool.shutdown()
+        source.close()
+    except BrokenPipeError:  #whoever was reading stopped early, so there is nobody to send the rest to
+        pass
+    except Exception as error:
+        decompressionerrors[readend] = str(error)
+    decompressionpipes.discard(writeend)
+    try:
+        pipe.close()
+    except BrokenPipeError:
+        pass
+
+def writecompletelines(pipe, data):  #writes the data up to and including its last line break to the pipe and returns the rest to go in front of the next piece.  Holding back the unfinished line means that if decompression fails, the reader never gets half a line that looks like a whole one
+    cut = data.rfind(b'\n') + 1
+    pipe.write(data[:cut])
+    return data[cut:]
+
+def readbgzfblock(source):  #reads the next BGZF block from an open file and returns its raw deflated data along with the CRC and decompressed size from its footer, or False at the end of the file
+    import struct
+    header = source.read(12)
+    if len(header) < 12:
+        return False
+    if header[0:2] != b'\x1f\x8b' or not header[3] & 4:  #every BGZF block is a gzip member with an extra field
+        raise ValueError('Not a BGZF block')
+    extralength = struct.unpack('<H', header[10:12])[0]
+    extra = source.read(extralength)
+    blocksize = False
+    i = 0
+    while i + 4 <= len(extra):  #look through the extra subfields for the BC one that holds the total block size
+        subfieldlength = struct.unpack('<H', extra[i + 2:i + 4])[0]
+        if extra[i:i + 2] == b'BC':
+            blocksize = struct.unpack('<H', extra[i + 4:i + 6])[0] + 1
+        i += 4 + subfieldlength
+    if not blocksize:
+        raise ValueError('BGZF block is missing its size')
+    data = source.read(blocksize - 12 - extralength)  #the rest of the block: the deflated data followed by the CRC and decompressed size
+    if len(data) != blocksize - 12 - extralength or len(data) < 8:
+        raise ValueError('BGZF block is cut short')
+    crc, size = struct.unpack('<II', data[-8:])
+    return (data[:-8], crc, size)
+
+def inflatebgzfblock(block):  #decompresses the raw data from a BGZF block and checks that we got the bytes the block said we would (both how many and their CRC)
+    import zlib
+    data = zlib.decompress(block[0], -15)  #negative window bits for raw deflate data with no zlib header
+    if len(data) != block[2]:
+        raise ValueError('BGZF block decompressed to the wrong size')
+    if zlib.crc32(data) != block[1]:
+        raise ValueError('BGZF block failed its CRC check')
+    return data
+
+def findchromosomeboundaries(filename):  #finds the byte ranges holding each chromosome in a VCF (sorted by chromosome the way ExAC is) using binary searches instead of reading the whole file.  Returns a list of (filename, start, end) ranges
+    import os
+    try:
+        vcf = open(filename, 'rb')
+        size = os.path.getsize(filename)
+        line = vcf.readline()
+        while line and line[0:1] == b'#':  #skip past the header
+            line = vcf.readline()
+        start = vcf.tell() - len(line)  #where the first data line starts
+    except:
+        quit('Error reading from ExAC VCF')
+    ranges = []
+    while start < size:
+        chromosome = chromosomeatoffset(vcf, start, size)[1]
+        low = start  #binary search for the first byte where the next line starts on a different chromosome
+        high = size
+        while high - low > 1:
+            middle = (low + high) // 2
+            if chromosomeatoffset(vcf, middle, size)[1] == chromosome:
+                low = middle
+            else:
+                high = middle
+        end = chromosomeatoffset(vcf, high, size)[0]  #the start of the first line on the next chromosome (or the end of the file)
+        ranges.append((filename, start, end))
+        start = end
+    vcf.close()
+    return ranges
+
+def chromosomeatoffset(vcf, offset, size):  #returns the start of the first line at or after a byte offset in an open VCF and the chromosome on that line (or False if we are at the end of the file)
+    if offset > 0:
+        vcf.seek(offset - 1)
+        vcf.readline()  #finishes off whatever line we landed in (if the byte before us was a line break, this just reads that)
+        offset = vcf.tell()
+    else:
+        vcf.seek(0)
+    if offset >= size:
+        return (size, False)
+    return (offset, vcf.readline().split(b'\t')[0])
+
+def slimlibraryline(linearray):  #takes a split ExAC line and returns it with only the chromosome, position, reference, and alternate columns plus the population AC, AN, and Hom fields from INFO.  Everything else becomes a placeholder dot so the columns stay where annotation expects them
+    import re
+    infofields = [field for field in linearray[7].strip('\n').split(';') if re.match('(AC|AN|Hom)_', field)]  #the huge CSQ strings and everything else that getfrequencyhash never looks at get dropped here
+    return [linearray[0], linearray[1], '.', linearray[3], linearray[4], '.', '.', ';'.join(infofields) + ';']  #the INFO field ends with a semicolon because getfrequencyhash looks for one after every value
 
 def createlibraryfile(chromosome, positionblock): #subroutine for generating subvcf files for the library
     libraryfilename = str('subvcfs/' + chromosome + 'c' + positionblock + '.subvcf')  #uses the chromosome and position block to generate the actual filename
@@ -160,6 +1079,451 @@ def createlibraryfile(chromosome, positionblock): #subroutine for generating sub
         quit('Error creating new library file.')
     return libraryfile #returns the newly created file handle to the part of the program that called it
 
+def createpackfile(chromosome):  #subroutine for opening the single data file that holds every block for a chromosome in the packed library format
+    try:
+        packfile = open('subvcfs/' + chromosome + '.pack', 'ab')  #opened as binary so that tell() gives us real byte offsets for the index.  Append mode just in case a chromosome shows up in more than one stretch of the VCF
+    except:
+        quit('Error creating new library file.')
+    return packfile
+
+def writepackindex(packindex):  #writes the packed library offset table as chromosome, position block, offset, and length separated by tabs
+    try:
+        indexfile = open('subvcfs/packindex', 'w')
+        for entry in packindex:
+            indexfile.write('\t'.join([str(item) for item in entry]) + '\n')
+        indexfile.close()
+    except:
+        return False
+    return True
+
+def writecatalog(catalog):  #writes the catalog of library blocks as block name, size in bytes, number of lines, and CRC32 checksum separated by tabs, so annotation can know which blocks exist without asking the filesystem
+    try:
+        catalogfile = open('subvcfs/catalog', 'w')
+        for entry in catalog:
+            catalogfile.write('\t'.join([str(item) for item in entry[0:3]] + ['%08x' % entry[3]]) + '\n')
+        catalogfile.close()
+    except:
+        return False
+    return True
+
+def loadcatalog(directory):  #reads the block catalog into a dictionary of block name: (bytes, lines, checksum), or returns False if the library does not have one (libraries split by older versions)
+    import os
+    if not os.path.isfile(directory + '/catalog'):
+        return False
+    catalog = {}
+    try:
+        catalogfile = open(directory + '/catalog', 'r')
+        for line in catalogfile:
+            entry = line.strip('\n').split('\t')
+            if len(entry) == 3:  #catalogs from before the checksums were added
+                entry.append(False)
+            if len(entry) != 4:
+                continue
+            catalog[entry[0]] = (int(entry[1]), int(entry[2]), entry[3])
+        catalogfile.close()
+    except:
+        quit('Error reading the library block catalog.')
+    return catalog
+
+def openlibrary(directory, cacheblocks = 256, cachemegabytes = 0, exacvcf = False, lazyverify = False):  #subroutine to get the library ready for reading.  Returns a dictionary describing the library format and anything needed to find blocks in it, including the cache of indexed blocks.  If exacvcf is given, blocks are read straight out of that VCF instead of a split library.  If lazyverify is set, each block's checksum is checked the first time it is read (if the library has block checksums)
+    import os
+    import collections
+    import mmap
+    import threading
+    libraryinfo = {'directory':directory, 'format':'directory', 'index':{}, 'packs':{}, 'packlock':threading.Lock(), 'cache':createblockcache(cacheblocks, cachemegabytes), 'exacvcf':exacvcf, 'presence':False, 'catalog':False, 'prefetch':False, 'usage':{}, 'warmprofile':False, 'sharedlibrary':False}
+    if exacvcf and not compressiontype(exacvcf):  #an uncompressed ExAC VCF.  We memory map it and use a sparse index of record positions to find where each block starts, so there is no opening or reading files per block and every process shares the OS page cache
+        libraryinfo['format'] = 'mmap'
+        libraryinfo['index'] = loadsparseindex(exacvcf)
+        try:
+            libraryinfo['vcf'] = open(exacvcf, 'rb')
+            libraryinfo['map'] = mmap.mmap(libraryinfo['vcf'].fileno(), 0, access = mmap.ACCESS_READ)
+        except:
+            quit('Error memory mapping the ExAC VCF.')
+    elif exacvcf:  #a bgzipped ExAC VCF with a tabix index.  We load the index once and keep a small cache of decompressed BGZF blocks, since neighboring library blocks often share them
+        libraryinfo['format'] = 'tabix'
+        libraryinfo['index'] = readtabixindex(exacvcf + '.tbi')
+        libraryinfo['bgzfcache'] = collections.OrderedDict()
+        libraryinfo['bgzfcacheblocks'] = 128
+        try:
+            libraryinfo['vcf'] = open(exacvcf, 'rb')
+        except:
+            quit('Error opening the ExAC VCF.')
+    elif os.path.isfile(directory + '/numpyindex'):  #a NumPy library.  The arrays for each chromosome get memory mapped the first time they are needed
+        libraryinfo['format'] = 'numpy'
+        libraryinfo['numpy'] = importnumpy()
+        libraryinfo['arrays'] = {}
+        try:
+            indexfile = open(directory + '/numpyindex', 'r')
+            libraryinfo['index'] = dict([(line.strip('\n'), True) for line in indexfile if line.strip()])
+            indexfile.close()
+        except:
+            quit('Error reading the NumPy library index.')
+    elif os.path.isfile(directory + '/recordindex'):  #a binary record library.  We keep the record and allele files open and binary search them with positioned reads
+        import struct
+        libraryinfo['format'] = 'binary'
+        libraryinfo['columns'] = sqlitecolumns(exacpopulations)
+        libraryinfo['recordsize'] = struct.calcsize(binaryrecord)
+        try:
+            indexfile = open(directory + '/recordindex', 'r')
+            chromosomes = [line.strip('\n') for line in indexfile if line.strip()]
+            indexfile.close()
+            libraryinfo['index'] = dict([(chromosomes[i], i) for i in range(0, len(chromosomes))])
+            libraryinfo['records'] = os.open(directory + '/library.records', os.O_RDONLY)
+            libraryinfo['alleles'] = os.open(directory + '/library.alleles', os.O_RDONLY)
+            recordbytes = os.fstat(libraryinfo['records']).st_size
+        except:
+            quit('Error opening the binary library.')
+        if recordbytes % libraryinfo['recordsize']:  #records of some other size, from an earlier layout
+            quit('The binary library records are not the size this version uses.  Please remove the subvcfs directory and redo the split.')
+        libraryinfo['recordcount'] = recordbytes // libraryinfo['recordsize']
+    elif os.path.isfile(directory + '/library.sqlite'):  #an SQLite library.  It is opened read only, so any number of annotation runs can read it at once
+        import sqlite3
+        libraryinfo['format'] = 'sqlite'
+        libraryinfo['columns'] = sqlitecolumns(exacpopulations)
+        try:
+            libraryinfo['connection'] = sqlite3.connect('file:' + directory + '/library.sqlite?mode=ro', uri = True)
+        except:
+            quit('Error opening the SQLite library.')
+    elif os.path.isfile(directory + '/packindex'):  #if we have a pack index, this is a packed library and we load the whole offset table into memory once
+        libraryinfo['format'] = 'packed'
+        try:
+            indexfile = open(directory + '/packindex', 'r')
+            for line in indexfile:
+                entry = line.strip('\n').split('\t')
+                if len(entry) != 4:  #skip anything that does not look like an index line
+                    continue
+                libraryinfo['index'][entry[0] + 'c' + entry[1] + '.subvcf'] = (entry[0], int(entry[2]), int(entry[3]))  #keyed on the same block name that the directory format uses as a filename
+            indexfile.close()
+        except:
+            quit('Error reading the packed library index.')
+    if not exacvcf:
+        libraryinfo['catalog'] = loadcatalog(directory)  #every block the library has, loaded once so that checking for a block is a dictionary lookup instead of a trip to the filesystem
+    libraryinfo['lazyverify'] = bool(lazyverify and libraryinfo['format'] in ('directory', 'packed') and libraryinfo['catalog'] and all([entry[2] for entry in libraryinfo['catalog'].values()]))  #only libraries made of blocks with checksums in the catalog can be checked a block at a time
+    libraryinfo['verified'] = set()
+    if not exacvcf and os.path.isfile(directory + '/presence.bloom'):  #if the split left us a Bloom filter, we can skip the library for positions that are not in it
+        libraryinfo['presence'] = loadpresencefilter(directory + '/presence.bloom')
+    return libraryinfo
+
+def readlibraryblock(libraryinfo, blockname):  #returns the text of a library block (or, for SQLite, NumPy, and binary libraries, the block already indexed by recordblock, and for the shared library, a memoryview of the block in shared memory), or False if the library has no block by that name
+    import os
+    if libraryinfo['format'] == 'tabix':  #pull the lines for the block's 10,000 bases out of the indexed VCF
+        chromosome, positionblock = blockname[:-7].rsplit('c', 1)  #block names are chromosome + 'c' + position block + '.subvcf'
+        return readtabixregion(libraryinfo, chromosome, int(positionblock), int(positionblock) + libraryblocksize)
+    if libraryinfo['format'] == 'mmap':  #same idea, but out of the memory mapped VCF
+        chromosome, positionblock = blockname[:-7].rsplit('c', 1)
+        return readmappedregion(libraryinfo, chromosome, int(positionblock), int(positionblock) + libraryblocksize)
+    if libraryinfo['format'] == 'numpy':
+        chromosome, positionblock = blockname[:-7].rsplit('c', 1)
+        return readnumpyregion(libraryinfo, chromosome, int(positionblock), int(positionblock) + libraryblocksize)
+    if libraryinfo['format'] == 'binary':
+        chromosome, positionblock = blockname[:-7].rsplit('c', 1)
+        return readbinaryregion(libraryinfo, chromosome, int(positionblock), int(positionblock) + libraryblocksize)
+    if libraryinfo['format'] == 'sqlite':
+        chromosome, positionblock = blockname[:-7].rsplit('c', 1)
+        return readsqliteregion(libraryinfo, chromosome, int(positionblock), int(positionblock) + libraryblocksize)
+    if libraryinfo['format'] == 'shared':  #the whole library is already in shared memory, so this is just a view of that part of it (no copy)
+        if blockname not in libraryinfo['index']:
+            return False
+        offset, length = libraryinfo['index'][blockname]
+        return libraryinfo['shared'].buf[offset:offset + length]
+    if libraryinfo['format'] == 'packed':
+        try:
+            chromosome, offset, length = libraryinfo['index'][blockname]  #dictionary lookup instead of a trip to the filesystem to see if the block exists
+        except KeyError:
+            return False
+        try:
+            if chromosome not in libraryinfo['packs']:  #pack files are opened the first time they are needed and then kept open for the rest of the run
+                with libraryinfo['packlock']:  #prefetch and warm up threads can get here at the same time, and only one of them should open the pack
+                    if chromosome not in libraryinfo['packs']:
+                        libraryinfo['packs'][chromosome] = os.open(libraryinfo['directory'] + '/' + chromosome + '.pack', os.O_RDONLY)
+            data = os.pread(libraryinfo['packs'][chromosome], length, offset)  #a single positioned read gets us the whole block
+        except:
+            quit('Error reading packed library file.')
+        if libraryinfo['lazyverify']:
+            verifylibraryblock(libraryinfo, blockname, data)
+        return data.decode('utf-8')
+    if libraryinfo['catalog'] is not False:  #otherwise, we are using the old one file per block format.  If the library has a catalog, that tells us whether the block is there
+        if blockname not in libraryinfo['catalog']:
+            return False
+    elif not os.path.isfile(libraryinfo['directory'] + '/' + blockname):
+        return False
+    if libraryinfo['lazyverify']:  #read the raw bytes so we can check them against the catalog before using them
+        try:
+            libraryfile = open(libraryinfo['directory'] + '/' + blockname, 'rb')
+            data = libraryfile.read()
+            libraryfile.close()
+        except:
+            quit('Error opening subvcf library file.')
+        verifylibraryblock(libraryinfo, blockname, data)
+        library = data.decode('utf-8')
+        if '\r' in library:  #same line ending handling as reading it as text
+            library = library.replace('\r\n', '\n').replace('\r', '\n')
+        return library
+    try:
+        libraryfile = open(libraryinfo['directory'] + '/' + blockname, 'r')
+        library = libraryfile.read() #slurps the whole file into the library string
+        libraryfile.close()
+    except:
+        quit('Error opening subvcf library file.')
+    return library
+
+def verifylibraryblock(libraryinfo, blockname, data):  #checks a block's raw data against the checksum in the catalog the first time the block is read, and stops everything if it does not match
+    import zlib
+    if blockname in libraryinfo['verified']:
+        return True
+    if '%08x' % zlib.crc32(data) != libraryinfo['catalog'][blockname][2]:
+        quit('Library block ' + blockname + ' does not match its checksum in the catalog.  The library may be damaged.  Please remove the subvcfs directory and redo the split.')
+    libraryinfo['verified'].add(blockname)
+    return True
+
+def buildsparseindex(filename, spacing = 256):  #reads through an uncompressed VCF and returns a dictionary of chromosome: [positions, byte offsets, end offset] holding every 256th record (and the first record of each chromosome)
+    import array
+    sparseindex = {}
+    try:
+        vcf = open(filename, 'rb')
+    except:
+        quit('Error opening the ExAC VCF to index it.')
+    print('Building a sparse position index for ' + filename + ' (this only needs to be done once)')
+    offset = 0
+    chromosome = False
+    count = 0
+    for line in vcf:
+        if line[0:1] != b'#' and line.strip():
+            linearray = line.split(b'\t', 2)
+            if linearray[0].decode('utf-8') != chromosome:  #new chromosome, close off the old one and start indexing the new one from its first record
+                if chromosome:
+                    sparseindex[chromosome][2] = offset
+                chromosome = linearray[0].decode('utf-8')
+                if chromosome in sparseindex:
+                    quit('The ExAC VCF must be sorted with each chromosome together to be read directly.')
+                sparseindex[chromosome] = [array.array('l'), array.array('q'), 0]
+                count = 0
+            if count % spacing == 0:
+                sparseindex[chromosome][0].append(int(linearray[1]))
+                sparseindex[chromosome][1].append(offset)
+            count += 1
+        offset += len(line)
+    if chromosome:
+        sparseindex[chromosome][2] = offset
+    vcf.close()
+    return sparseindex
+
+def loadsparseindex(filename):  #loads the sparse index saved next to the VCF, or builds and saves it if it is missing, older than the VCF, or incomplete
+    import os
+    indexfilename = filename + '.sparseindex'
+    if os.path.isfile(indexfilename) and os.path.getmtime(indexfilename) >= os.path.getmtime(filename):
+        sparseindex = readsparseindex(indexfilename)
+        if sparseindex:
+            return sparseindex
+        print('The sparse index ' + indexfilename + ' is incomplete and will be built again.')
+    sparseindex = buildsparseindex(filename)
+    savesparseindex(sparseindex, indexfilename)
+    return sparseindex
+
+def savesparseindex(sparseindex, indexfilename):  #writes the sparse index to a temporary file and then moves it into place, so another process reading the index never sees one that is only partly written.  The last line records how many chromosomes and entries there are, so a damaged index can be recognised
+    import os
+    temporaryname = indexfilename + '.' + str(os.getpid()) + '.tmp'  #several processes may be building the same index at once, so each one gets its own temporary file
+    entries = 0
+    try:
+        indexfile = open(temporaryname, 'w')
+        for chromosome in sparseindex:
+            indexfile.write(chromosome + '\tend\t' + str(sparseindex[chromosome][2]) + '\n')
+            for i in range(0, len(sparseindex[chromosome][0])):
+                indexfile.write(chromosome + '\t' + str(sparseindex[chromosome][0][i]) + '\t' + str(sparseindex[chromosome][1][i]) + '\n')
+                entries += 1
+        indexfile.write('#complete\t' + str(len(sparseindex)) + '\t' + str(entries) + '\n')
+        indexfile.close()
+        os.replace(temporaryname, indexfilename)
+    except OSError:  #not fatal, we just have to index again next time
+        print('Unable to save the sparse index to ' + indexfilename)
+        if os.path.isfile(temporaryname):
+            os.remove(temporaryname)
+        return False
+    return True
+
+def readsparseindex(indexfilename):  #reads a saved sparse index, or returns False if it does not end with a complete final line that matches what was read before it
+    import array
+    sparseindex = {}
+    entries = 0
+    complete = False
+    try:
+        indexfile = open(indexfilename, 'r')
+        lines = indexfile.read().split('\n')
+        indexfile.close()
+    except (OSError, UnicodeDecodeError):
+        quit('Error reading the sparse index ' + indexfilename)
+    if len(lines) < 2 or lines[-1] != '' or not lines[-2].startswith('#complete\t'):  #the index must end with the line break after the complete line
+        return False
+    try:
+        for line in lines[:-1]:
+            entry = line.split('\t')
+            if len(entry) != 3:
+                return False
+            if entry[0] == '#complete':
+                complete = (int(entry[1]), int(entry[2]))
+                continue
+            if entry[0] not in sparseindex:
+                sparseindex[entry[0]] = [array.array('l'), array.array('q'), 0]
+            if entry[1] == 'end':
+                sparseindex[entry[0]][2] = int(entry[2])
+            else:
+                sparseindex[entry[0]][0].append(int(entry[1]))
+                sparseindex[entry[0]][1].append(int(entry[2]))
+                entries += 1
+    except ValueError:
+        return False
+    if complete != (len(sparseindex), entries):
+        return False
+    return sparseindex
+
+def readmappedregion(libraryinfo, chromosome, start, end):  #returns the VCF lines (as text) for a chromosome with positions from start up to (not including) end out of the memory mapped VCF, or False if there are none
+    import bisect
+    if chromosome not in libraryinfo['index'] and 'chr' + chromosome in libraryinfo['index']:
+        chromosome = 'chr' + chromosome
+    if chromosome not in libraryinfo['index']:
+        return False
+    positions, offsets, chromosomeend = libraryinfo['index'][chromosome]
+    first = max(bisect.bisect_left(positions, start) - 1, 0)  #the last indexed record before our start.  Several records can share a position, so we back up to one that is strictly before it
+    last = bisect.bisect_left(positions, end)  #the first indexed record at or past our end
+    if last < len(offsets):
+        regionend = offsets[last]
+    else:
+        regionend = chromosomeend
+    lines = []
+    for line in libraryinfo['map'][offsets[first]:regionend].decode('utf-8').split('\n'):  #at most a couple of index spacings worth of lines outside the block to skip
+        linearray = line.split('\t', 2)
+        if len(linearray) < 3:
+            continue
+        position = int(linearray[1])
+        if position >= end:
+            break
+        if position >= start:
+            lines.append(line)
+    if not lines:
+        return False
+    return '\n'.join(lines) + '\n'
+
+def readtabixindex(filename):  #reads a tabix (.tbi) index into a dictionary with the reference sequence names, the bins of chunks (pairs of virtual file offsets) for each reference, and the linear index of smallest offsets for each 16kb window
+    import gzip
+    import struct
+    try:
+        indexfile = gzip.open(filename, 'rb')  #tabix indexes are BGZF compressed
+        data = indexfile.read()
+        indexfile.close()
+    except:
+        quit('Error reading the tabix index ' + filename)
+    if data[0:4] != b'TBI\x01':
+        quit('The file ' + filename + ' does not look like a tabix index.')
+    referencecount, indexformat, sequencecolumn, begincolumn, endcolumn, meta, skip, nameslength = struct.unpack_from('<8i', data, 4)
+    if indexformat != 2 or sequencecolumn != 1 or begincolumn != 2 or endcolumn != 0 or meta != ord('#') or skip != 0:  #the settings tabix uses for a VCF (-p vcf).  Anything else means the lines are laid out differently from what we read them as
+        quit('The tabix index ' + filename + ' was not made with the VCF settings (tabix -p vcf).  Please index the ExAC VCF again with tabix -p vcf.')
+    offset = 36
+    names = data[offset:offset + nameslength].split(b'\x00')  #the names are null-terminated and packed together
+    offset += nameslength
+    tabix = {'references':{}, 'bins':[], 'linear':[]}
+    for i in range(0, referencecount):
+        tabix['references'][names[i].decode('utf-8')] = i
+        bins = {}
+        bincount = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        for j in range(0, bincount):
+            binnumber, chunkcount = struct.unpack_from('<Ii', data, offset)
+            offset += 8
+            chunks = struct.unpack_from('<' + str(chunkcount * 2) + 'Q', data, offset)  #each chunk is a start and end virtual offset
+            offset += chunkcount * 16
+            bins[binnumber] = [(chunks[k], chunks[k + 1]) for k in range(0, len(chunks), 2)]
+        intervalcount = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        tabix['bins'].append(bins)
+        tabix['linear'].append(struct.unpack_from('<' + str(intervalcount) + 'Q', data, offset))
+        offset += intervalcount * 8
+    return tabix
+
+def tabixregionbins(begin, end):  #the list of bins that could hold records overlapping the zero-based region from begin up to (not including) end, using the standard binning scheme from the SAM/tabix specification
+    bins = [0]
+    end -= 1
+    for shift, binoffset in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+        bins += list(range(binoffset + (begin >> shift), binoffset + (end >> shift) + 1))
+    return bins
+
+def bgzfblockat(libraryinfo, blockoffset):  #returns the decompressed data of the BGZF block starting at a file offset in the ExAC VCF and the offset of the block after it, using a small least recently used cache
+    cache = libraryinfo['bgzfcache']
+    if blockoffset in cache:
+        cache.move_to_end(blockoffset)
+        return cache[blockoffset]
+    try:
+        libraryinfo['vcf'].seek(blockoffset)
+        block = readbgzfblock(libraryinfo['vcf'])
+        nextoffset = libraryinfo['vcf'].tell()
+    except:
+        quit('Error reading from the ExAC VCF.')
+    if block:
+        try:
+            data = inflatebgzfblock(block)
+        except:
+            quit('The ExAC VCF is damaged: the BGZF block at offset ' + str(blockoffset) + ' did not decompress correctly.')
+    else:  #end of the file
+        data = b''
+    cache[blockoffset] = (data, nextoffset)
+    if len(cache) > libraryinfo['bgzfcacheblocks']:
+        cache.popitem(last = False)
+    return cache[blockoffset]
+
+def readtabixregion(libraryinfo, chromosome, start, end):  #returns the VCF lines (as text) for a chromosome with positions from start up to (not including) end, or False if there are none.  Only the BGZF blocks the index points us to get read and decompressed
+    tabix = libraryinfo['index']
+    if chromosome in tabix['references']:
+        reference = tabix['references'][chromosome]
+    elif 'chr' + chromosome in tabix['references']:  #in case the VCF names its chromosomes with chr in front
+        reference = tabix['references']['chr' + chromosome]
+    else:
+        return False
+    begin = max(start - 1, 0)  #VCF positions start at 1, tabix regions start at 0
+    window = begin >> 14
+    linear = tabix['linear'][reference]
+    minimumoffset = 0  #the linear index tells us the earliest a record overlapping our region could start, so we can skip chunks that end before that
+    if window < len(linear):
+        minimumoffset = linear[window]
+    elif linear:
+        minimumoffset = linear[-1]
+    chunks = []
+    for binnumber in tabixregionbins(begin, end - 1):
+        for chunk in tabix['bins'][reference].get(binnumber, []):
+            if chunk[1] > minimumoffset:
+                chunks.append(chunk)
+    if not chunks:
+        return False
+    chunks.sort()
+    mergedchunks = [list(chunks[0])]
+    for chunk in chunks[1:]:  #merge overlapping chunks so we don't read any record twice
+        if chunk[0] <= mergedchunks[-1][1]:
+            mergedchunks[-1][1] = max(mergedchunks[-1][1], chunk[1])
+        else:
+            mergedchunks.append(list(chunk))
+    lines = []
+    for chunkstart, chunkend in mergedchunks:
+        blockoffset = chunkstart >> 16  #a virtual offset is the file offset of the BGZF block shifted up 16 bits plus the offset within the decompressed block
+        withinblock = chunkstart & 65535
+        pieces = []
+        while True:
+            data, nextoffset = bgzfblockat(libraryinfo, blockoffset)
+            if blockoffset == chunkend >> 16:
+                pieces.append(data[withinblock:chunkend & 65535])
+                break
+            pieces.append(data[withinblock:])
+            if not data or blockoffset > chunkend >> 16:
+                break
+            blockoffset = nextoffset
+            withinblock = 0
+        for line in b''.join(pieces).decode('utf-8').split('\n'):
+            linearray = line.split('\t', 2)
+            if len(linearray) < 3 or line[0] == '#':
+                continue
+            if linearray[0] in (chromosome, 'chr' + chromosome) and start <= int(linearray[1]) < end:  #chunks can hold records from outside our region, so only keep the ones that are really in it
+                lines.append(line)
+    if not lines:
+        return False
+    return '\n'.join(lines) + '\n'
+
 def yesanswer(question):  #asks the question passed in and returns True if the answer is yes, False if the answer is no, and keeps the user in a loop until one of those is given.  Also useful for walking students through basic logical python functions
     answer = False  #initializes the answer variable to false.  Not absolutely necessary, since it should be undefined at this point and test to false, but explicit is always better than implicit
     while not answer:  #enters the loop and stays in it until answer is equal to True
@@ -280,6 +1644,59 @@ def getfrequencyhash(line, populations, position):  #this is the "pointy end" of
                 frequencyhash[datum[0]][datum[1]] = datum[2]
     return frequencyhash
 
+def getallelevalues(frequencyhash, chromosome, datapoints, populations):  #takes the frequency hash for an allele and returns the list of values we output for it: each population for each datapoint, with the maximum across populations after each datapoint
+    values = []
+    for point in datapoints: #iterate throught the datapoints
+        pointvalues = []
+        for population in populations: #iterate through the populations
+            if point == 'AF':  #if we are analyzing allele frequency, that equates to the number of times seen in the population divided by the chromosomes counted for the population
+                try:
+                    entry = int(frequencyhash['AC'][population])/int(frequencyhash['AN'][population])
+                except KeyError:  #if we get a key error, that means that the allele is unique, so the frequency for it being seen is zero
+                    entry = 0
+                except ZeroDivisionError:  #if we get a zero division error, that means the locus had no coverage in the population and we cannot make a call
+                    entry = 'NA'
+            elif point == 'HOMOF':  #if we are analyzing homozygous frequency for the allele
+                if chromosome not in ('X','x','Y','y','MT','Mt','mt'): #first we check and make sure it's not a sex chromosome (due to issues with hemizogosity) or the mitochondrial DNA
+                    try:
+                        entry = int(frequencyhash['Hom'][population])/(int(frequencyhash['AN'][population])/2)  #if it is an autosome, homozygosity frequency is estimated as homozygotes counted/(chromosomes/2)
+                    except KeyError:  #if we get a key error (meaning the allele is not reported in exac), we assume the allele to be unique (or at least have zero frequency in this database) and have zero homozygotes
+                        entry = 0
+                    except ZeroDivisionError: #and if we get no coverage at the locus, we return NA
+                        entry = 'NA'
+                else:
+                    entry = 'NA'  #we also return NA for non-autosomal variants here to avoid giving false information in the case of hemizygosity (GitHub currently reports that ExAC does not handle hemizygosity for sex chromosomes very well)
+            pointvalues.append(entry)
+        maximum = 0
+        for value in pointvalues: #iterate throught the populations
+            if value != 'NA':  #if the value was not reported as NA (indicating no coverage)
+                if maximum < value: #if the current value being inspected is greater than the previous maximum
+                    maximum = value #that value becomes the new maximum
+        values += pointvalues
+        values.append(maximum) #after iterating through all populations, we have the maximum and that gets entered in the list of values
+    return values
+
+def precomputedcolumn(linearray, populations, datapoints):  #builds the extra library column holding the finished output values for every alternate allele on an ExAC line, so annotation does not have to parse the INFO field.  Alleles are separated by pipes and values by commas
+    alleles = []
+    for i in range(0, len(linearray[4].split(','))):  #one set of values for each alternate allele, in the same order as the ALT column
+        values = getallelevalues(getfrequencyhash(linearray[7], populations, i), linearray[0], datapoints, populations)
+        alleles.append(','.join([str(value) for value in values]))
+    return 'ExACto=' + '|'.join(alleles)
+
+def parseprecomputed(column):  #turns a precomputed library column back into a list of value lists (one per alternate allele) with the same types getallelevalues would have given us, so that the output looks exactly the same
+    precomputed = []
+    for allele in column[7:].split('|'):  #skip past the ExACto= tag
+        values = []
+        for value in allele.split(','):
+            if value == 'NA':
+                values.append(value)
+            elif '.' in value or 'e' in value:
+                values.append(float(value))
+            else:
+                values.append(int(value))
+        precomputed.append(values)
+    return precomputed
+
 def addvcfinfolines(outputfile, numberalleles, datapoints, populations):
     poplong = {'AFR':'African/African American','AMR':'American','EAS':'East Asian','FIN':'Finnish','NFE':'Non-Finnish European','SAS':'South Asian','OTH':'Other'} #creates a dictionary for the population abbreviations
     datalong = {'AF':'Allele frequency (Allele observed/chromosomes counted)','HOMOF':'Homozygote Frequency (Homozygotes observed/[chromosomes counted/2])'} #creates a dictionary for the datapoint abbreviations
@@ -297,23 +1714,503 @@ def addvcfinfolines(outputfile, numberalleles, datapoints, populations):
         quit('Error writing to output file.')
 
 
-def annotate(file):  #and now for our main event
+def indexlibraryblock(library):  #takes the raw text of a library block and builds a sorted array of the positions in it along with where each line starts in the text.  Lines are left unsplit until we actually need one
+    import re
+    import array
+    positions = array.array('l')  #compact integer arrays instead of lists of split lines
+    linestarts = array.array('l')
+    for match in re.finditer('^[^\t\n]*\t([0-9]+)\t', library, re.MULTILINE):  #grabs the position from every line that looks like data.  Garbage lines just won't match
+        linestarts.append(match.start())
+        positions.append(int(match.group(1)))
+    return {'text':library, 'positions':positions, 'linestarts':linestarts}
+
+def indexsharedblock(view):  #same as indexlibraryblock, but for a block sitting in the shared library.  The regular expression runs over the shared memory itself and we keep where each line ends as well, so lines can be decoded one at a time without ever making a private copy of the block
+    import re
+    import array
+    positions = array.array('l')
+    linestarts = array.array('l')
+    lineends = array.array('l')
+    for match in re.finditer(b'^[^\t\n]*\t([0-9]+)\t[^\n]*', view, re.MULTILINE):
+        linestarts.append(match.start())
+        lineends.append(match.end())
+        positions.append(int(match.group(1)))
+    return {'view':view, 'positions':positions, 'linestarts':linestarts, 'lineends':lineends}
+
+def createblockcache(maxblocks, maxmegabytes):  #creates a least recently used cache for indexed library blocks.  It can be limited by number of blocks, by megabytes, or both (a limit of 0 means no limit of that kind)
+    import collections
+    return {'blocks':collections.OrderedDict(), 'sizes':{}, 'maxblocks':maxblocks, 'maxbytes':maxmegabytes * 1048576, 'bytes':0, 'hits':0, 'misses':0, 'evictions':0}
+
+def blocksize(block):  #rough estimate of how much memory an indexed block takes up (the text plus the two position arrays, or the estimate recordblock made).  Shared blocks only cost us their arrays, since the text stays in shared memory
+    if not block:
+        return 0
+    if 'lines' in block:
+        return block['bytes']
+    if 'view' in block:
+        return (block['positions'].itemsize * len(block['positions'])) * 3
+    return len(block['text']) + (block['positions'].itemsize * len(block['positions'])) + (block['linestarts'].itemsize * len(block['linestarts']))
+
+def loadlibraryblock(libraryinfo, blockname):  #gets an indexed library block, from the cache if we have it, otherwise by reading and indexing it.  Returns False if there is no such block
+    cache = libraryinfo['cache']
+    libraryinfo['usage'][blockname] = libraryinfo['usage'].get(blockname, 0) + 1  #how often each block gets asked for, for the usage profile
+    if blockname in cache['blocks']:  #cache hit, mark this block as the most recently used and hand it back
+        cache['hits'] += 1
+        cache['blocks'].move_to_end(blockname)
+        return cache['blocks'][blockname]
+    cache['misses'] += 1
+    if libraryinfo['prefetch'] and blockname in libraryinfo['prefetch']['pending']:  #the prefetcher already went to get this one
+        block = takeprefetchedblock(libraryinfo, blockname)
+    else:
+        block = fetchlibraryblock(libraryinfo, blockname)  #we cache missing blocks (False) too, so we don't have to go looking for them again
+    cachelibraryblock(libraryinfo, blockname, block)
+    return block
+
+def cachelibraryblock(libraryinfo, blockname, block):  #puts a block in the cache as the most recently used one and evicts the least recently used blocks if that takes us over the limits
+    cache = libraryinfo['cache']
+    if cache['maxblocks'] or cache['maxbytes']:  #if both limits are 0, the cache is turned off
+        cache['blocks'][blockname] = block
+        cache['sizes'][blockname] = blocksize(block)
+        cache['bytes'] += cache['sizes'][blockname]
+        while len(cache['blocks']) > 1 and ((cache['maxblocks'] and len(cache['blocks']) > cache['maxblocks']) or (cache['maxbytes'] and cache['bytes'] > cache['maxbytes'])):  #evict the least recently used blocks until we are back under the limits (but always keep the one we just loaded)
+            oldblockname = cache['blocks'].popitem(last = False)[0]
+            cache['bytes'] -= cache['sizes'].pop(oldblockname)
+            cache['evictions'] += 1
+
+def fetchlibraryblock(libraryinfo, blockname):  #reads and indexes a library block, or returns False if there is no such block.  The prefetcher runs this on its threads
+    library = readlibraryblock(libraryinfo, blockname)
+    if not library:
+        return False
+    if libraryinfo['format'] in ('sqlite', 'numpy', 'binary'):  #these come back already indexed
+        return library
+    if libraryinfo['format'] == 'shared':
+        return indexsharedblock(library)
+    return indexlibraryblock(library)
+
+def startprefetcher(libraryinfo, rows, threads = 4):  #sets up reading library blocks ahead of time on a pool of threads.  Rows is how many input lines ahead we look for blocks we are going to need
+    import concurrent.futures
+    if libraryinfo['format'] in ('tabix', 'sqlite'):  #these read through a single shared file handle or database connection, which can't be used from several threads at once
+        print('Prefetching is not available for this library format.')
+        return False
+    if not (libraryinfo['cache']['maxblocks'] or libraryinfo['cache']['maxbytes']):  #with nowhere to keep the blocks, every one we read ahead would just be read again
+        print('Prefetching needs the library block cache, so it is turned off.')
+        return False
+    libraryinfo['prefetch'] = {'pool':concurrent.futures.ThreadPoolExecutor(max_workers = threads), 'pending':{}, 'rows':rows, 'read':0, 'finished':0, 'issued':0, 'ready':0, 'waited':0, 'dropped':0}
+    return True
+
+def prefetchline(line, settings, libraryinfo):  #works out which block an input line will need and starts reading it if it isn't already cached or on its way.  Each block on its way remembers the last line read ahead that needs it, so it can be dropped once that line is done with if nothing took it (the line may have been answered from the memo or the annotation cache instead)
+    prefetch = libraryinfo['prefetch']
+    prefetch['read'] += 1
+    blockname = lineblockname(line, settings)
+    if not blockname or blockname in libraryinfo['cache']['blocks']:
+        return False
+    if blockname in prefetch['pending']:
+        prefetch['pending'][blockname][1] = prefetch['read']
+        return False
+    if libraryinfo['cache']['maxblocks'] and len(prefetch['pending']) >= libraryinfo['cache']['maxblocks']:  #blocks on their way count against the cache's limit too
+        return False
+    if libraryinfo['presence']:  #no point fetching a block for a position the Bloom filter says ExAC does not have
+        chromosome, position = lineposition(line, settings)
+        if not checkpresence(libraryinfo['presence'], chromosome, int(position)):
+            return False
+    prefetch['pending'][blockname] = [prefetch['pool'].submit(fetchlibraryblock, libraryinfo, blockname), prefetch['read']]
+    prefetch['issued'] += 1
+    return True
+
+def takeprefetchedblock(libraryinfo, blockname):  #hands over a block the prefetcher read, waiting for it if it isn't done yet
+    prefetch = libraryinfo['prefetch']
+    future = prefetch['pending'].pop(blockname)[0]
+    if future.done():
+        prefetch['ready'] += 1
+    else:
+        prefetch['waited'] += 1
+    return future.result()
+
+def dropprefetchedblocks(libraryinfo):  #lets go of blocks read ahead for lines that are now finished without ever using them, so they don't pile up outside the cache
+    prefetch = libraryinfo['prefetch']
+    for blockname in [blockname for blockname in prefetch['pending'] if prefetch['pending'][blockname][1] <= prefetch['finished']]:
+        prefetch['pending'].pop(blockname)[0].cancel()  #if it is already being read, the result just gets thrown away
+        prefetch['dropped'] += 1
+
+def readahead(readline, lookahead, settings, libraryinfo):  #returns the next input line, keeping a window of lines read ahead of it (using the readline subroutine given) so the blocks they need can be prefetched while we work.  Being asked for a line means the one before it is done
+    libraryinfo['prefetch']['finished'] += 1
+    dropprefetchedblocks(libraryinfo)
+    while len(lookahead) <= libraryinfo['prefetch']['rows']:
+        newline = readline()
+        if not newline:
+            break
+        lookahead.append(newline)
+        prefetchline(newline, settings, libraryinfo)
+    if lookahead:
+        return lookahead.popleft()
+    return ''
+
+def stopprefetcher(libraryinfo):  #shuts down the prefetch threads and returns a summary of how well prefetching did
+    prefetch = libraryinfo['prefetch']
+    unused = len(prefetch['pending']) + prefetch['dropped']
+    prefetch['pool'].shutdown(cancel_futures = True)
+    used = prefetch['ready'] + prefetch['waited']
+    if used:
+        hitrate = str(round(100 * prefetch['ready'] / used, 1)) + '%'
+    else:
+        hitrate = 'NA'
+    return 'Prefetching: ' + str(prefetch['issued']) + ' blocks read ahead, ' + str(prefetch['ready']) + ' ready when needed, ' + str(prefetch['waited']) + ' still loading when needed, ' + str(unused) + ' never used (prefetch hit rate ' + hitrate + ').'
+
+def startpipeline(inputfile, outputfile, batchlines, queuebatches, flushbatches):  #starts a reader thread that reads the input file in batches of lines and a writer thread that writes out annotated lines in batches, with no more than queuebatches batches waiting on either side of the annotation so memory use stays bounded.  Returns the pipeline dictionary that the other pipeline subroutines work from
+    import queue
+    import threading
+    pipeline = {'input' : queue.Queue(queuebatches), 'output' : queue.Queue(queuebatches), 'batchlines' : batchlines, 'flushbatches' : flushbatches, 'lines' : [], 'nextline' : 0, 'batch' : [], 'ended' : False, 'error' : False, 'batches' : 0, 'flushes' : 0}
+    pipeline['reader'] = threading.Thread(target = readinputbatches, args = (inputfile, pipeline), daemon = True)  #daemon threads so that they never hold the program open if we quit early
+    pipeline['writer'] = threading.Thread(target = writeoutputbatches, args = (outputfile, pipeline), daemon = True)
+    pipeline['reader'].start()
+    pipeline['writer'].start()
+    return pipeline
+
+def readinputbatches(inputfile, pipeline):  #reader thread: reads the input in batches of lines and queues them up for annotation (waiting if the queue is full), then queues an empty batch to mark the end of the file
+    import itertools
+    while True:
+        try:
+            batch = list(itertools.islice(inputfile, pipeline['batchlines']))
+        except:
+            pipeline['error'] = 'Error reading from input file.'
+            batch = []
+        pipeline['input'].put(batch)
+        if not batch:
+            return
+
+def nextinputline(pipeline):  #returns the next input line from the reader thread's batches, or an empty string at the end of the file (just like readline would)
+    if pipeline['nextline'] == len(pipeline['lines']):
+        if pipeline['ended']:
+            return ''
+        pipeline['lines'] = pipeline['input'].get()
+        pipeline['nextline'] = 0
+        if not pipeline['lines']:
+            pipeline['ended'] = True
+            if pipeline['error']:
+                quit(pipeline['error'])
+            return ''
+    line = pipeline['lines'][pipeline['nextline']]
+    pipeline['nextline'] += 1
+    return line
+
+def writeoutputbatches(outputfile, pipeline):  #writer thread: writes each queued batch of annotated lines to the output in a single write, flushing the file every flushbatches batches (never until the end if it is 0), until it gets an empty batch
+    while True:
+        batch = pipeline['output'].get()
+        if not batch:
+            break
+        if pipeline['error']:  #keep taking batches off the queue so that annotation is never left waiting on it, there is just no point writing them
+            continue
+        try:
+            outputfile.write(''.join(batch))
+            pipeline['batches'] += 1
+            if pipeline['flushbatches'] and not pipeline['batches'] % pipeline['flushbatches']:
+                outputfile.flush()
+                pipeline['flushes'] += 1
+        except:
+            pipeline['error'] = 'Error writing to output file.'
+    try:
+        outputfile.flush()
+    except:
+        pipeline['error'] = 'Error writing to output file.'
+
+def pipelinewrite(pipeline, datastring):  #adds an annotated line to the batch being built and hands the batch to the writer thread once it is full
+    pipeline['batch'].append(datastring)
+    if len(pipeline['batch']) >= pipeline['batchlines']:
+        if pipeline['error']:
+            quit(pipeline['error'])
+        pipeline['output'].put(pipeline['batch'])
+        pipeline['batch'] = []
+
+def stoppipeline(pipeline):  #hands the last partial batch to the writer thread, waits for it to finish writing everything, and quits if either thread ran into trouble.  Returns a summary of the writing that was done
+    if pipeline['batch']:
+        pipeline['output'].put(pipeline['batch'])
+        pipeline['batch'] = []
+    pipeline['output'].put([])
+    pipeline['writer'].join()
+    if pipeline['error']:
+        quit(pipeline['error'])
+    return 'Output was written in ' + str(pipeline['batches']) + ' batches of up to ' + str(pipeline['batchlines']) + ' lines with ' + str(pipeline['flushes'] + 1) + ' flushes.'
+
+def libraryfingerprint(directory, exacvcf = False):  #identifies the library we are annotating from by hashing its manifest (which has a checksum for every block), or by the fingerprint of the ExAC VCF if we are reading straight from one.  Any change to the library changes the fingerprint.  Returns False if there is nothing to identify the library by, including libraries from before there were manifests
+    import os
+    import hashlib
+    digest = hashlib.blake2b(libraryversion.encode(), digest_size = 16)  #annotations from another version of this program may not match, so that goes in too
+    if exacvcf:
+        fingerprint = sourcefingerprint(exacvcf)
+        if not fingerprint:
+            return False
+        digest.update('\t'.join(fingerprint).encode())
+        return digest.hexdigest()
+    if not os.path.isfile(directory + '/manifest'):  #the old hashsum only covers the file names, so a library whose blocks changed would still match its stale annotations
+        return False
+    try:
+        manifestfile = open(directory + '/manifest', 'rb')
+        digest.update(manifestfile.read())
+        manifestfile.close()
+    except OSError:
+        return False
+    return digest.hexdigest()
+
+def openannotationcache(filename, fingerprint, purge = False):  #opens (creating it if needed) the SQLite file of finished annotations that is kept from one run to the next.  Several jobs can share the file at once.  If purge is set, annotations made from any other library are cleared out.  Returns a dictionary for the other annotation cache subroutines to work from, or False if the cache could not be opened
+    import sqlite3
+    try:
+        connection = sqlite3.connect(filename, timeout = 60)  #if another job is writing to the cache, wait for it instead of giving up
+        connection.execute('PRAGMA journal_mode=WAL')  #lets other jobs keep reading the cache while one of them writes to it
+        connection.execute('CREATE TABLE IF NOT EXISTS annotations (fingerprint TEXT, chromosome TEXT, position TEXT, reference TEXT, observed TEXT, segment TEXT, PRIMARY KEY (fingerprint, chromosome, position, reference, observed)) WITHOUT ROWID')
+        if purge:
+            connection.execute('DELETE FROM annotations WHERE fingerprint != ?', (fingerprint,))
+        connection.commit()
+    except sqlite3.Error:
+        return False
+    return {'connection':connection, 'fingerprint':fingerprint, 'pending':[]}
+
+def readannotationcache(cache, locus, delimiter):  #returns the added columns stored for a locus (chromosome, position, reference, observed), or None if this library has not annotated it before
+    import sqlite3
+    try:
+        row = cache['connection'].execute('SELECT segment FROM annotations WHERE fingerprint = ? AND chromosome = ? AND position = ? AND reference = ? AND observed = ?', (cache['fingerprint'],) + locus).fetchone()
+    except sqlite3.Error:
+        return None
+    if row is None:
+        return None
+    return row[0].replace('\t', delimiter)  #the cache is stored tab-delimited whatever the input was
+
+def addannotationcache(cache, locus, segment, delimiter, batchsize = 1000):  #queues up the added columns for a locus to go into the annotation cache, writing them out once batchsize of them are waiting
+    cache['pending'].append((cache['fingerprint'],) + locus + (segment.replace(delimiter, '\t'),))
+    if len(cache['pending']) >= batchsize:
+        saveannotationcache(cache)
+
+def saveannotationcache(cache):  #writes the annotations waiting to go into the cache in a single transaction.  Loci another job already added are left as they are.  Returns the number of loci added
+    import sqlite3
+    if not cache['pending']:
+        return 0
+    try:
+        with cache['connection']:
+            added = cache['connection'].executemany('INSERT OR IGNORE INTO annotations VALUES (?, ?, ?, ?, ?, ?)', cache['pending']).rowcount
+    except sqlite3.Error:
+        print('Unable to add ' + str(len(cache['pending'])) + ' loci to the annotation cache.')
+        added = 0
+    cache['pending'] = []
+    return added
+
+def createsharedlibrary(libraryinfo, threads = 8):  #loads every block of the library into a single shared memory segment that worker processes can attach to, so the library is only held in memory once no matter how many workers there are.  Uses the block catalog to size the segment and lay out where each block goes, so the blocks can be read in parallel straight into their places.  Returns the segment and an index of block name: (offset, length)
+    import concurrent.futures
+    from multiprocessing import shared_memory
+    catalog = libraryinfo['catalog']
+    layout = {}
+    totalbytes = 0
+    for blockname in catalog:
+        layout[blockname] = totalbytes
+        totalbytes += catalog[blockname][0]
+    print('Loading the library into shared memory (' + str(round(totalbytes / 1048576, 1)) + ' MB).')
+    try:
+        shared = shared_memory.SharedMemory(create = True, size = max(totalbytes, 1))
+    except (OSError, ValueError):
+        quit('Unable to create a shared memory segment for the library.  Please try again without the shared library.')
+    def loadsharedblock(blockname):  #reads one block into its place in the segment and returns how long it turned out to be (or False if it is not there)
+        library = readlibraryblock(libraryinfo, blockname)
+        if not library:
+            return False
+        data = rawbytes(library)
+        if len(data) > catalog[blockname][0]:  #would run over into the next block
+            return -1
+        shared.buf[layout[blockname]:layout[blockname] + len(data)] = data
+        return len(data)
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers = threads)
+    try:
+        lengths = list(pool.map(loadsharedblock, list(catalog)))
+    except BaseException:  #a block that can't be read stops the run (quit raises SystemExit), and the segment has to go with it since the caller never got it
+        pool.shutdown()
+        shared.close()
+        shared.unlink()
+        raise
+    pool.shutdown()
+    index = {}
+    for blockname, length in zip(catalog, lengths):
+        if length == -1:
+            shared.close()
+            shared.unlink()
+            quit('Library block ' + blockname + ' is larger than the catalog says.  Please remove the subvcfs directory and redo the split.')
+        if length:
+            index[blockname] = (layout[blockname], length)
+    return (shared, index)
+
+def attachsharedlibrary(libraryinfo, name, index):  #runs in a worker process: switches the library over to reading blocks out of the shared memory segment the main process loaded.  Blocks are indexed in place, so the cache only needs to hold their position arrays and can be a lot smaller
+    from multiprocessing import shared_memory
+    try:
+        libraryinfo['shared'] = shared_memory.SharedMemory(name = name)
+    except (OSError, ValueError):
+        quit('Unable to attach to the shared library.')
+    libraryinfo['format'] = 'shared'
+    libraryinfo['index'] = index
+    libraryinfo['lazyverify'] = False  #the blocks were already checked (if they were going to be) when the main process loaded them
+
+def readprofile(filename):  #reads a usage profile into a dictionary of block name: number of times used.  A missing profile is just an empty one
+    import os
+    profile = {}
+    if not os.path.isfile(filename):
+        return profile
+    try:
+        profilefile = open(filename, 'r')
+        for line in profilefile:
+            entry = line.strip('\n').split('\t')
+            if len(entry) == 2:
+                profile[entry[0]] = int(entry[1])
+        profilefile.close()
+    except:
+        quit('Error reading the usage profile ' + filename)
+    return profile
+
+def recordprofile(filename, usage):  #adds the blocks used on this run to the usage profile, so the blocks used the most over many runs end up at the top.  Runs that finish at the same time take turns through a lock file, and the new profile is written to a temporary file and moved into place, so no run's counts are lost and the profile is never left half written
+    import os
+    import fcntl
+    try:
+        lockfile = open(filename + '.lock', 'w')
+        fcntl.flock(lockfile, fcntl.LOCK_EX)  #waits here for any other run that is updating the profile
+    except OSError:
+        quit('Unable to lock the usage profile ' + filename)
+    profile = readprofile(filename)
+    for blockname in usage:
+        profile[blockname] = profile.get(blockname, 0) + usage[blockname]
+    temporaryname = filename + '.' + str(os.getpid()) + '.tmp'
+    try:
+        profilefile = open(temporaryname, 'w')
+        for blockname in sorted(profile, key = lambda blockname: (-profile[blockname], blockname)):
+            profilefile.write(blockname + '\t' + str(profile[blockname]) + '\n')
+        profilefile.close()
+        os.replace(temporaryname, filename)
+        written = True
+    except OSError:
+        written = False
+    lockfile.close()  #closing it lets the next run in
+    if not written:
+        quit('Error writing the usage profile ' + filename)
+
+def warmlibrary(libraryinfo, filename, threads = 8):  #loads the most used blocks from a usage profile into the cache before we start (as many as the cache will hold), reading them in parallel.  Returns the number of blocks loaded
+    import concurrent.futures
+    cache = libraryinfo['cache']
+    if not (cache['maxblocks'] or cache['maxbytes']):
+        print('The library cache is turned off, so there is nothing to warm up.')
+        return 0
+    profile = readprofile(filename)
+    hottest = sorted(profile, key = lambda blockname: (-profile[blockname], blockname))
+    if cache['maxblocks']:
+        hottest = hottest[0:cache['maxblocks']]
+    if libraryinfo['format'] in ('tabix', 'sqlite'):  #a single shared file handle or database connection that only this thread can use, so these get read one at a time right here
+        blocks = [fetchlibraryblock(libraryinfo, blockname) for blockname in hottest]
+    else:
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers = threads)
+        blocks = list(pool.map(lambda blockname: fetchlibraryblock(libraryinfo, blockname), hottest))
+        pool.shutdown()
+    loaded = 0
+    totalbytes = 0
+    while loaded < len(hottest) and not (cache['maxbytes'] and totalbytes + blocksize(blocks[loaded]) > cache['maxbytes']):  #as many of the hottest blocks as fit under the size limit
+        totalbytes += blocksize(blocks[loaded])
+        loaded += 1
+    for i in reversed(range(0, loaded)):  #coldest first, so the hottest blocks are the last ones evicted
+        cachelibraryblock(libraryinfo, hottest[i], blocks[i])
+    return loaded
+
+def cachecounts(libraryinfo):  #returns the block cache counters as a list of hits, misses, evictions, blocks held, and bytes held
+    cache = libraryinfo['cache']
+    return [cache['hits'], cache['misses'], cache['evictions'], len(cache['blocks']), cache['bytes']]
+
+def cachereport(counts):  #returns a summary of how the block cache did on this run for sizing it
+    return 'Library block cache: ' + str(counts[0]) + ' hits, ' + str(counts[1]) + ' misses, ' + str(counts[2]) + ' evictions, ' + str(counts[3]) + ' blocks (' + str(round(counts[4] / 1048576, 1)) + ' MB) held at the end of the run.'
+
+def countvalues(counts, columns, chromosome, missing = None):  #works out the finished values for one allele from its AC/AN/Hom counts (in the order of columns, with missing standing in for counts ExAC does not have), the same way they would come out of its INFO field
+    frequencyhash = {}  #the same structure getfrequencyhash builds, filled in straight from the counts
+    for j in range(0, len(columns)):
+        if counts[j] != missing:
+            datapoint, population = columns[j].split('_')
+            if datapoint not in frequencyhash:
+                frequencyhash[datapoint] = {}
+            frequencyhash[datapoint][population] = counts[j]
+    return getallelevalues(frequencyhash, chromosome, exacdatapoints, exacpopulations)
+
+def recordblock(lines):  #makes an indexed block out of library lines that are already split into fields, with the finished values for each alternate allele in the ninth field as a list of value lists instead of precomputed text.  This is what the SQLite, NumPy, and binary libraries give us, and these blocks never go through indexlibraryblock or parseprecomputed
+    import array
+    positions = array.array('l', [int(line[1]) for line in lines])
+    size = positions.itemsize * len(positions)
+    for line in lines:
+        size += 100 + len(line[3]) + len(line[4]) + 24 * sum([len(values) for values in line[8]])  #rough, but these only need to be comparable with the text blocks for the cache limits
+    return {'positions':positions, 'lines':lines, 'bytes':size}
+
+def findlibraryline(block, position, low = 0):  #binary search of an indexed block for the first line at the position.  Returns the index of that line in the block or False if the position is not there.  Low lets the merge cursor skip the part of the block it has already passed
+    import bisect
+    if not block:
+        return False
+    i = bisect.bisect_left(block['positions'], position, low)
+    if i < len(block['positions']) and block['positions'][i] == position:
+        return i
+    return False
+
+def getlibraryline(block, i):  #pulls a single line out of the block text and splits it into fields.  This is the only line in the block that gets split.  Blocks from recordblock are already split, so we just hand back the line
+    if 'lines' in block:
+        return block['lines'][i]
+    if 'view' in block:  #decode just this line out of shared memory
+        return str(block['view'][block['linestarts'][i]:block['lineends'][i]], 'utf-8').split('\t')
+    start = block['linestarts'][i]
+    end = block['text'].find('\n', start)
+    if end == -1:  #last line of a block that does not end in a line break
+        end = len(block['text'])
+    return block['text'][start:end].split('\t')
+
+def mergelookup(cursor, libraryinfo, blockname, position):  #merge join lookup for sorted inputs: moves the library cursor forward to the position and returns the line there (already split on tabs), or False if there is none.  The cursor never moves backwards, so this only works if positions come in sorted order
+    import bisect
+    if cursor['block'] != blockname:  #we only load a block when the input moves into it, and then never again
+        cursor['library'] = loadlibraryblock(libraryinfo, blockname)
+        cursor['block'] = blockname
+        cursor['index'] = 0
+    if not cursor['library']:  #no block here, so there is nothing to find until the input moves to another block
+        return False
+    cursor['index'] = bisect.bisect_left(cursor['library']['positions'], position, cursor['index'])  #move forward to the first line at or past the position.  If the position is there, we leave the cursor on it in case the next input line has the same position with different alleles
+    i = findlibraryline(cursor['library'], position, cursor['index'])
+    if i is False:
+        return False
+    return getlibraryline(cursor['library'], i)
+
+def annotate(file, cacheblocks = 256, cachemegabytes = 0, workers = 1, exacvcf = False, verify = False, lazyverify = False, prefetch = 0, profile = False, warm = False, sharedlibrary = False, batchlines = 1000, queuebatches = 4, flushbatches = 1, memoloci = 100000, annotationcache = False, purgecache = False):  #and now for our main event.  If exacvcf is given, the ExAC data is read straight from that VCF instead of the split library.  If verify is set, every library file's checksum is checked before starting.  If lazyverify is set, nothing is checked up front and each block is checked the first time it is read instead.  If prefetch is more than 0, library blocks are read that many input lines ahead on background threads.  If profile is given, the blocks used are added to that usage profile file, and if warm is given, the most used blocks in that profile are loaded before starting.  If sharedlibrary is set, the whole library is loaded once into shared memory for the worker processes to read from.  If batchlines is more than 0 (and there are no worker processes), the input is read and the output written on their own threads in batches of that many lines, with up to queuebatches batches waiting on each side and the output flushed every flushbatches batches.  The added columns for up to memoloci loci are remembered so that repeats of them anywhere in the file can be written straight out.  If annotationcache is given, finished annotations are kept in that file from one run to the next (each one only used with the library it came from), and if purgecache is set, the ones from other libraries are deleted first
     import os
     import re
-    if not os.path.isdir('subvcfs'): #if the library isn't already made or can't be found
+    import collections
+    if not exacvcf and not os.path.isdir('subvcfs'): #if the library isn't already made or can't be found
         usage('No subvcf library detected in this directory.  Please be sure the script is running from the same directory that contains the library.')
         quit()
     fileformat = 'tdt'  #default format is tab-delimited
     delimiter = '\t'  #meaning that the delimiter is a tab
-    lastlibraryfile = False  #initializes the lastlibrary file to false (we will use this to remember which library file we used in the last iteration so we don't reopen it if we don't have to)
-    populations = ['AFR','AMR','EAS','FIN','NFE','SAS','OTH'] #initializing a list of the population in the ExAC
-    datapoints = ['AF','HOMOF'] #initializing a list of the datapoins we will output for each population
+    libraryinfo = openlibrary('subvcfs', cacheblocks, cachemegabytes, exacvcf, lazyverify)  #figures out if we have a packed or a one file per block library and loads the block index for a packed one
+    populations = exacpopulations #the populations in the ExAC
+    datapoints = exacdatapoints #the datapoints we will output for each population
     summarycolumns = ['F_rarest_allele','Combo_max']
+    maxindex = {}
+    for i in range(0, len(datapoints)):  #where the maximum for each datapoint sits in an allele's list of values (after all of that datapoint's populations)
+        maxindex[datapoints[i]] = ((i + 1) * (len(populations) + 1)) - 1
     newcolumns = (((len(populations) +1) * len(datapoints)) * 2) + len(summarycolumns)  #logic here is that the number of columns we add is one for each datapoint for each population plus one for the maxvalue times two possible alleles for the line plus two for the columns we add that summarize population data (such as the frequency of the rarest allele and combo max) 
-    if not checkintegrity('subvcfs'):  #checks the subvcf directory to be sure that no directories have been gained or lost or had their name changed since it was created
-        quit('Check of subvcf library directory not passed.  Please be sure no files have been added, removed, or renamed in the library director')
+    if lazyverify and not libraryinfo['lazyverify'] and not exacvcf:
+        print('This library does not have block checksums, so it will be checked up front instead of a block at a time.')
+    if not exacvcf and not libraryinfo['lazyverify'] and not checkintegrity('subvcfs', verify):  #checks the subvcf directory against its manifest to be sure that no files have been gained, lost, renamed, or cut short since it was created (and that none have been changed, if we are verifying)
+        quit('Check of subvcf library directory not passed.  Please be sure no files have been added, removed, renamed, or changed in the library directory')
+    if sharedlibrary and workers < 2:
+        print('The shared library is only used with worker processes (-w).')
+        sharedlibrary = False
+    elif sharedlibrary and not (libraryinfo['format'] in ('directory', 'packed') and libraryinfo['catalog']):
+        print('The shared library needs a directory or packed library with a block catalog.  Workers will read the library themselves.')
+        sharedlibrary = False
+    if warm and workers > 1:  #each worker process warms up its own cache when it starts
+        libraryinfo['warmprofile'] = warm
+    elif warm:
+        print('Loaded ' + str(warmlibrary(libraryinfo, warm)) + ' library blocks from the usage profile.')
+    diskcache = False
+    cachesettings = False
+    if annotationcache:
+        fingerprint = libraryfingerprint('subvcfs', exacvcf)
+        if not fingerprint:
+            print('The library has no manifest to identify it by, so the annotation cache will not be used.  Rebuilding the integrity files (-i) will create one.')
+        else:
+            diskcache = openannotationcache(annotationcache, fingerprint, purgecache)  #annotations from other libraries are never looked at because the fingerprint is part of the key, so they only get cleared out when asked (another job might still be using them)
+            if not diskcache:
+                quit('Unable to open the annotation cache.')
+            cachesettings = (annotationcache, fingerprint)  #what the workers need to open it for themselves
     try:
-        inputfile = open(file, 'r') #opens the file to be annotated
+        inputfile = openinputfile(file) #opens the file to be annotated (and starts decompressing it if it is gzipped)
     except:
         quit('Error opening input file')
     outputfilename = file + '.ExACtoed.txt'  #creates the name of the output file
@@ -321,13 +2218,16 @@ def annotate(file):  #and now for our main event
         usage('Output file already exists, please move, delete, or rename the existing output file for this source.')    #off for debugging only
         quit()                                                                                                           #off for debugging only
     try:
-        outputfile = open(outputfilename, 'w', 1) #opens the output file
+        outputfile = open(outputfilename, 'w', 1048576) #opens the output file with a large buffer so that it is written in big pieces rather than a line at a time
     except:
         quit('Error opening the output file.')
     try:  #This try/except (like most of the others you will see here) is to either read or write to a file, and end more gracefully if something fails in the process
         header = inputfile.readline().strip('\r\n') #reads the first line from the file to annotate.  This should be the header with all the column names.  We need to analyze this to determine where the important columns are
     except:
         quit('Error reading header from input file.')
+    if not header:
+        checkinputfile(inputfile, file)  #a compressed file can come up empty because it could not be decompressed
+        quit('The input file is empty.')
     doublehashcount = 0
     vcflike = False
     vcfinfolineswritten = False
@@ -393,307 +2293,430 @@ def annotate(file):  #and now for our main event
         outputfile.write(outputheaderstring) #then write the whole thing to the output file (which will now have its header line)
     except:
         quit('Error writing header to output file.')
-    lastchromosome = False #initialize a bunch of values before starting a loop that will iterate through the datalines on the file
-    lastposition = False
-    lastreference = False
-    lastobserved = False
-    newlines = 0
-    repeatlines = 0
-    librarylinesplit = False
+    settings = {'fileformat':fileformat, 'delimiter':delimiter, 'headercolumns':headercolumns, 'chromosomecolumn':chromosomecolumn, 'positioncolumn':positioncolumn, 'referencecolumn':referencecolumn, 'observedcolumn':observedcolumn, 'populations':populations, 'datapoints':datapoints, 'summarycolumns':summarycolumns, 'newcolumns':newcolumns, 'maxindex':maxindex, 'memoloci':memoloci, 'annotationcache':cachesettings}  #everything annotateline needs to know about this file, gathered up so it can be handed to worker processes too
+    state = createannotationstate(True, False, diskcache)
+    lookahead = collections.deque()  #input lines read ahead for the prefetcher
+    if prefetch and workers > 1:
+        print('Prefetching is only done without worker processes.')
+    elif prefetch and startprefetcher(libraryinfo, prefetch):
+        prefetchline(line, settings, libraryinfo)
     #reflineout = open('rfo.txt', 'w', 1)  #debugging only
-    while line: #iterates through the file (so long as we load the next line to analyze before starting it).  If we have a blank line with nothing on it, this loop will end
-        line = line.strip('\r\n') #take the new line and strip off any unwanted break or delimiter characters from the ends 
-        linenumber += 1 #increment the line number counter
-        #if linenumber >= 248: #debug only
-        #    pass #debug only
-        if line[0] == '#':  #if the first character of the line is a hashtag (indicating a comment and not data), 
-            print('Skipped line ' + str(linenumber) + ' as it appears to be a comment.')  #tell the user we are skipping the line
+    if workers > 1:  #hand the file off to worker processes in chunks
+        shared = False
+        try:
+            if sharedlibrary:  #loaded only now that everything has been checked, so a run that stops early never fills up shared memory
+                shared, index = createsharedlibrary(libraryinfo)
+                libraryinfo['sharedlibrary'] = (shared.name, index)  #what the workers need to find it
+            cachetotals = parallelannotate(inputfile, outputfile, line, settings, libraryinfo, state, workers)
+        finally:  #the shared memory outlives this process unless we remove it, so make sure that happens even if something goes wrong
+            if shared:
+                shared.close()
+                shared.unlink()
+    else:
+        pipeline = False
+        readline = inputfile.readline
+        if batchlines:  #reading and writing move onto their own threads and happen in batches
+            pipeline = startpipeline(inputfile, outputfile, batchlines, queuebatches, flushbatches)
+            readline = lambda: nextinputline(pipeline)
+        while line: #iterates through the file (so long as we load the next line to analyze before starting it).  If we have a blank line with nothing on it, this loop will end
+            linenumber += 1 #increment the line number counter
+            if linenumber % 10000 == 0:
+                print ('Processing line ' + str(linenumber), end = '\r') #update the progress counter displayed to the user (every so often, printing every line slows things down)
+            datastring = annotateline(line, linenumber, settings, libraryinfo, state)
+            for message in state['messages']:  #tell the user anything that came up on this line
+                print(message)
+            state['messages'] = []
+            if pipeline:
+                pipelinewrite(pipeline, datastring)  #the writer thread takes it from here once the batch fills up
+            else:
+                try:
+                    outputfile.write(datastring) #and, regardless of which statement was used to write the datastring (new line or repeat line), we write it to the output file
+                except:
+                    quit('Error writing to output file.')
             try:
-                outputfile.write(line)  #write the line straight to the output file
+                if libraryinfo['prefetch']:
+                    line = readahead(readline, lookahead, settings, libraryinfo)  #the same, but through the read-ahead window so upcoming blocks can be fetched in the background
+                else:
+                    line = readline()  #then we read a new line from the input file (if it reads blank becaue it's the end of the file, the loop will exit)
             except:
-                quit('Error writing to output file.')
-            line = inputfile.readline() #read a new line
-            continue #and restart the loop
-        print ('Processing line ' + str(linenumber), end = '\r') #update the progress counter displayed to the user
-        if fileformat == 'tdt': #this pair of IF statements just uses the filetype that we determined earlier to figure out how to split the lines (as above, if the file is CSV, it may have quoted elements and those need to be handled differently)
-            linearray = line.split('\t')
-        elif fileformat == 'csv':
-            linearray = quotedsplit(line)
-        chromosome = re.sub('^chr', '',linearray[chromosomecolumn], flags=re.IGNORECASE) #because we want only the name of the chromosome, but sometimes chromosomes are recorded as chr##, this will remove chr from the beginning of the chromosome value (and do so regardless of the case of the letters).  Then it will save the value as chromosome
-        position = linearray[positioncolumn] #this saves the position value from the data line to position (this is simple and we don't have to worry that someone put anything in front of it).  The next two lines do the same thing
-        reference = linearray[referencecolumn]
-        observed = linearray[observedcolumn]
-        if not (chromosome == lastchromosome and position == lastposition and reference == lastreference and observed == lastobserved): #This asks if the current chromosome, position, reference, and observed alleles are the same as the last time we iterated through.  In an output listing several possible transcripts for each variant, this recycling of already-calculated values cuts more than 50% of the time required.
-            newlines += 1  #if not, we increment the count of newlines (this is only for display to the user at the end and not used for analysis)
-            frequencyhash = {}  #initializing a bunch of values
-            refmismatch = False
-            refandaltswapped = False
-            extraalleles = False
-            observedarray = []
-            observed = observed.strip('"')
-            if '/' in observed: #series of if statements just checks for any splitting characters (comma or slash) in the observed alleles field.  If so, it splits it into a list on the character.  If not, it just creates a one element table from it (so that we always have a list, and don't have to worry about ending up with a string for a single allele)
-                observedarray = observed.split('/')
-            elif ',' in observed:
-                observedarray = observed.split(',')
+                quit('Error reading from input file.')
+        print ('Processed ' + str(linenumber) + ' lines.')
+        if pipeline:
+            print (stoppipeline(pipeline))
+        if diskcache:
+            saveannotationcache(diskcache)
+        cachetotals = cachecounts(libraryinfo)
+    checkinputfile(inputfile, file)  #if the input was compressed and turned out to be damaged, the output is missing lines and the user needs to know
+    try:
+        outputfile.close()
+    except:
+        quit('Error writing to output file.')
+    print ('Annotated ' + str(state['newlines']) + ' unique loci and ' + str(state['repeatlines']) + ' duplicated lines.' )  #Tells the user a summary of what was done.
+    if state['mergejoin']:
+        print ('Input was sorted by chromosome and position, so the library was read in a single forward pass.')
+    if diskcache:
+        print ('Found ' + str(state['cachedlines']) + ' of the unique loci in the annotation cache.')
+    print (cachereport(cachetotals))
+    if libraryinfo['prefetch']:
+        print (stopprefetcher(libraryinfo))
+    if profile:
+        recordprofile(profile, libraryinfo['usage'])
+        print ('Recorded ' + str(len(libraryinfo['usage'])) + ' library blocks used on this run in the usage profile.')
+    #reflineout.close()  #debugging only
+
+def annotateline(line, linenumber, settings, libraryinfo, state):  #annotates a single line from the input file and returns the line to write to the output.  Anything that needs to be remembered from one line to the next (like the last locus for repeated lines and where the library cursor is) lives in the state dictionary, and messages for the user are added to its list of messages
+    import re
+    fileformat = settings['fileformat']  #pulls the settings we worked out from the header back out into easier-to-remember names
+    delimiter = settings['delimiter']
+    headercolumns = settings['headercolumns']
+    chromosomecolumn = settings['chromosomecolumn']
+    positioncolumn = settings['positioncolumn']
+    referencecolumn = settings['referencecolumn']
+    observedcolumn = settings['observedcolumn']
+    populations = settings['populations']
+    datapoints = settings['datapoints']
+    summarycolumns = settings['summarycolumns']
+    newcolumns = settings['newcolumns']
+    maxindex = settings['maxindex']
+    line = line.strip('\r\n') #take the new line and strip off any unwanted break or delimiter characters from the ends 
+    if line[0] == '#':  #if the first character of the line is a hashtag (indicating a comment and not data), 
+        state['messages'].append('Skipped line ' + str(linenumber) + ' as it appears to be a comment.')  #tell the user we are skipping the line
+        return line  #and the line goes straight to the output file
+    if fileformat == 'tdt': #this pair of IF statements just uses the filetype that we determined earlier to figure out how to split the lines (as above, if the file is CSV, it may have quoted elements and those need to be handled differently)
+        linearray = line.split('\t')
+    elif fileformat == 'csv':
+        linearray = quotedsplit(line)
+    chromosome = re.sub('^chr', '',linearray[chromosomecolumn], flags=re.IGNORECASE) #because we want only the name of the chromosome, but sometimes chromosomes are recorded as chr##, this will remove chr from the beginning of the chromosome value (and do so regardless of the case of the letters).  Then it will save the value as chromosome
+    position = linearray[positioncolumn] #this saves the position value from the data line to position (this is simple and we don't have to worry that someone put anything in front of it).  The next two lines do the same thing
+    reference = linearray[referencecolumn]
+    observed = linearray[observedcolumn]
+    locus = (chromosome, position, reference, observed)
+    segment = None
+    if locus == state['lastlocus']: #This asks if the current chromosome, position, reference, and observed alleles are the same as the last time we iterated through.  In an output listing several possible transcripts for each variant, this recycling of already-calculated values cuts more than 50% of the time required.
+        segment = state['segment']
+        state['repeatlines'] += 1 #add one to the number of repeated lines we ran
+    elif locus in state['memo'] and not state['memo'][locus][1]:  #or if we have annotated this locus somewhere further back in the file (multi-sample files list the same variant over and over).  Loci that needed a warning are worked out again so the user hears about every line with the problem
+        segment = state['memo'][locus][0]
+        state['memo'].move_to_end(locus)
+        state['repeatlines'] += 1
+    elif state['diskcache']:  #or if an earlier run using this same library annotated it, we can take it from the annotation cache before going anywhere near the library
+        segment = readannotationcache(state['diskcache'], locus, delimiter)
+        if segment is not None:
+            state['newlines'] += 1
+            state['cachedlines'] += 1
+            rememberlocus(state, settings, locus, segment, False)
+    if segment is None:
+        messagecount = len(state['messages'])
+        state['newlines'] += 1  #if not, we increment the count of new lines (this is only for display to the user at the end and not used for analysis)
+        frequencyhash = {}  #initializing a bunch of values
+        allelevalues = {}
+        refmismatch = False
+        refandaltswapped = False
+        extraalleles = False
+        observedarray = []
+        observed = observed.strip('"')
+        if '/' in observed: #series of if statements just checks for any splitting characters (comma or slash) in the observed alleles field.  If so, it splits it into a list on the character.  If not, it just creates a one element table from it (so that we always have a list, and don't have to worry about ending up with a string for a single allele)
+            observedarray = observed.split('/')
+        elif ',' in observed:
+            observedarray = observed.split(',')
+        else:
+            observedarray.append(observed)
+        currentlibraryfile = libraryblockname(chromosome, position)  #uses the chromosome and position data to name the library file to look for ExAC reference data
+        if state['mergejoin'] and not checksortorder(state, chromosome, int(position)):  #check that the input is still coming in sorted order before we trust the cursor to only move forward
+            state['messages'].append('Input does not appear to be sorted by chromosome and position at line ' + str(linenumber) + '.  Switching to random access library lookups.')
+        if libraryinfo['presence'] and not checkpresence(libraryinfo['presence'], chromosome, int(position)):  #the Bloom filter says ExAC has nothing at this position, so there is no need to touch the library at all
+            reflinearray = False
+        elif state['mergejoin']:
+            reflinearray = mergelookup(state['mergecursor'], libraryinfo, currentlibraryfile, int(position))  #walk the library cursor forward to this position
+        else:
+            if currentlibraryfile != state['lastlibraryfile']:  #only load and index the block if it is not the one we used last time
+                state['library'] = loadlibraryblock(libraryinfo, currentlibraryfile)
+                state['lastlibraryfile'] = currentlibraryfile
+            i = findlibraryline(state['library'], int(position))  #binary search the block for this position
+            if i is False:
+                reflinearray = False
             else:
-                observedarray.append(observed)
-            currentlibraryfile = str(chromosome) + 'c' + str(int(position) - (int(position) % 10000)) + '.subvcf'  #uses the chromosome and position data to name the library file to look for ExAC reference data
-            if os.path.isfile('subvcfs/' + currentlibraryfile): #checks if the library file exists
-                founddata = True #if so, sets this value appropriately
+                reflinearray = getlibraryline(state['library'], i)
+        refline = reflinearray
+        if reflinearray:
+            founddata = True
+        else:
+            founddata = False  #set this value so the rest of this program knows to treat it as an unseen variant
+        if founddata: #if we found data for that locus (if we didn't, we get to skip all this work)
+            exacalts = reflinearray[4].split(',') #creates an array of alternate alleles seen in exac
+            exacalthash = {}
+            for i in range (0, len(exacalts)): #creates a hash with the allele number:allele sequence as pairs
+                exacalthash[exacalts[i]]= i
+            if refline and (reflinearray[3] != reference):  #makes sure again that we have some value in refline (we shouldn't be here if we don't) and then checks to make sure that the variant caller called the same reference allele as ExAC has
+                refmismatch = True  #set this value so the rest of the program knows the line has mismatched references
+                if reflinearray[3] in observedarray:  #if the reference value from ExAC was observed as an alternate allele in the data
+                    for allele in observedarray:  #and if we iterate through each allele
+                        if allele == reflinearray[3] or allele in exacalts:  #and find that each allele was listed as either the reference or alternate allele in ExAC
+                            refandaltswapped = True  #we set this value to true, since the reference and alternates were swapped between sources.  We will still not make a call, but the message displayed will be different (this sometimes happens with very common variants where differnt sources think one is more common and call it reference)
+                if refandaltswapped:
+                    state['messages'].append('Reference and alternate alleles swapped between input and ExAC on line ' + str(linenumber) + '.')
+                else:
+                    state['messages'].append('Reference base mismatch starting on line ' + str(linenumber) + '.')  #let the user know there was a mismatch (this is important because a bunch of mismatches can indicate different Hg versions used to annotate between the reference and variant files)    
             else:
-                founddata = False  #if not, sets it to false so we can stop looking
-            if founddata: #if we did find the appropriate library file
-                if currentlibraryfile != lastlibraryfile:  #if it is not the same library file as last time, we open a new one, read the whole thing into memory (making regex searches faster) and then close it
-                    try:
-                        libraryfile = open('subvcfs/' + currentlibraryfile, 'r')
-                        library = libraryfile.read() #slurps the whole file into the library string
-                        libraryfile.close()
-                        librarylinesplit = False
-                    except:
-                        quit('Error opening subvcf library file.')
-                #refline = re.search('^(' + str(chromosome) + '\t' + str(position) + '\t.*?)$', library, re.MULTILINE) #search the library for a line with the same chromosome and position, then take that entire line and save it as refline
-                refline = False
-                founddata = re.search('\t'+str(position)+'\t', library)
-                if founddata:  #quick check to see if the position of interest is possibly in the file.  Make sure this is actually quick.  Actually benchmark it.
-                    if not librarylinesplit:
-                        library = library.split('\n')  #split the file into an array by line
-                        library = [libraryline.split('\t') for libraryline in library]  #split each line into fields using tabs.  I will never get used to list comprehension.
-                        librarylinesplit = True
-                    for i in range (0,len(library)):  #iterate over the library lines
-                        try:  #dealing with any possible garbage lines that may arise
-                            if int(library[i][1]) < int(position):  #if the position of the line is smaller than the position we want, move to the next line
-                                continue
-                            elif int(library[i][1]) ==  int(position):  #if the position is the one we are looking for
-                                refline = library[i]  #record the line (now as an array) as the line of interest
-                                break  #that'll do pig, that'll do
-                            elif int(library[i][1]) > int(position):  #if we have read past the number of the position we were looking for (because it wasn't there, hopefully)
-                                break #bugger it, it's not here
-                        except IndexError:  #if the line is garbage of some kind and didn't split properly
-                            continue
-                    if not refline: #if refline is blank because we did not find anything
-                        founddata = False  #set this value so the rest of this program knows to treat it as an unseen variant
-                    else:  #because we changed the code this go and the line is already split, all I need to do is move the line we got into the reflinearray value unchanged (alternatively, I could edit the rest of this code to use refline, but no)
-                    #    refline = refline.group(0) #otherwise we extract the line from the regular expression returned value (and get rid of the rest of the regex junk)
-                    #    #reflineout.write(refline + '\n')  #debugging only
-                        reflinearray = refline
-                if founddata: #if we found data for that locus (if we didn't, we get to skip all this work)
-                    exacalts = reflinearray[4].split(',') #creates an array of alternate alleles seen in exac
-                    exacalthash = {}
-                    for i in range (0, len(exacalts)): #creates a hash with the allele number:allele sequence as pairs
-                        exacalthash[exacalts[i]]= i
-                    if refline and (reflinearray[3] != reference):  #makes sure again that we have some value in refline (we shouldn't be here if we don't) and then checks to make sure that the variant caller called the same reference allele as ExAC has
-                        refmismatch = True  #set this value so the rest of the program knows the line has mismatched references
-                        if reflinearray[3] in observedarray:  #if the reference value from ExAC was observed as an alternate allele in the data
-                            for allele in observedarray:  #and if we iterate through each allele
-                                if allele == reflinearray[3] or allele in exacalts:  #and find that each allele was listed as either the reference or alternate allele in ExAC
-                                    refandaltswapped = True  #we set this value to true, since the reference and alternates were swapped between sources.  We will still not make a call, but the message displayed will be different (this sometimes happens with very common variants where differnt sources think one is more common and call it reference)
-                        if refandaltswapped:
-                            print('Reference and alternate alleles swapped between input and ExAC on line ' + str(linenumber) + '.')
-                        else:
-                            print('Reference base mismatch starting on line ' + str(linenumber) + '.')  #let the user know there was a mismatch (this is important because a bunch of mismatches can indicate different Hg versions used to annotate between the reference and variant files)    
+                try:
+                    observedarray.remove(reference)  #if the observed alleles contains the reference allele, we remove it (since we don't analyze frequency data from it).  At some point, we could probably deduce the data for it from the listed data, and then we could include that
+                    if len(observedarray) > 1: #if we do this and still have more than one allele left, we have three reported alleles, and need to report the line as an error (possibly a bad read or mosaic)
+                        extraalleles = True
+                    singlenonref = True  #if we could remove that value without error, then we have a single non-reference allele
+                except:
+                    singlenonref = False  #if not, then both alleles are non-reference
+                    if len(observedarray) == 1: #if only one observed allele is listed, it is homozygous and non-reference
+                        homozygousrare = True
+                    elif len(observedarray) > 1 and observedarray[0] == observedarray[1]: #if we have more than one element in the observed array and those elements are the same
+                        homozygousrare = True #the subject is homozygous for a rare allele
+                        observedarray.remove(observedarray[0]) #and we remove the duplicated allele so we don't analyze it twice
+                        if len(observedarray) > 1: #if we remove one allele from an identical pair and still have two alleles on the set, there was a third allele reported
+                            extraalleles = True
                     else:
-                        try:
-                            observedarray.remove(reference)  #if the observed alleles contains the reference allele, we remove it (since we don't analyze frequency data from it).  At some point, we could probably deduce the data for it from the listed data, and then we could include that
-                            if len(observedarray) > 1: #if we do this and still have more than one allele left, we have three reported alleles, and need to report the line as an error (possibly a bad read or mosaic)
-                                extraalleles = True
-                            singlenonref = True  #if we could remove that value without error, then we have a single non-reference allele
-                        except:
-                            singlenonref = False  #if not, then both alleles are non-reference
-                            if len(observedarray) == 1: #if only one observed allele is listed, it is homozygous and non-reference
-                                homozygousrare = True
-                            elif len(observedarray) > 1 and observedarray[0] == observedarray[1]: #if we have more than one element in the observed array and those elements are the same
-                                homozygousrare = True #the subject is homozygous for a rare allele
-                                observedarray.remove(observedarray[0]) #and we remove the duplicated allele so we don't analyze it twice
-                                if len(observedarray) > 1: #if we remove one allele from an identical pair and still have two alleles on the set, there was a third allele reported
-                                    extraalleles = True
-                            else:
-                                if not extraalleles: #if we did not get back an indication of three alleles or more at the locus
-                                    homozygousrare = False #the subject is heterozygous at the locus for two non-reference alleles
-                        if not extraalleles and len(observedarray) in range(1,3):
-                            extraalleles = False #one last check to make sure we don't have extra alleles
-                            for allele in (observedarray): #go through each of the observed alleles
-                                try: #use these try/except statements to build a frequency hash for each allele (the frequency hash data structure is better explained in the getfrequencyhash subroutine)
-                                    frequencyhash[allele] = getfrequencyhash(reflinearray[7], populations, exacalthash[allele])  #the frequency hash for each allele is set to the returned value (a hash of hashes itself) from the getfrequencyhash subroutine
-                                except KeyError:  #if it returns a keyerror (because the hash of alternate alleles observed for ExAC did not list this allele), then this variant is unique and we need a hash full of zeroes for the frequency (and ones for the chromosome count, to avoid divisio by zero)
-                                    frequencyhash[allele] = createzerohash(populations)
-                        else:
-                            print('Possible error on line ' + str(linenumber) + ', subject appears to have more than 2 alleles.') #if we hit this statement because there were extra alleles on the line (more than 2)
-                            extraalleles = True #set this value (which should already be set)
-                        if not extraalleles: #otherwise, we continue the analysis
-                            i = 0  #initialize a bunch of values
-                            namelist = []
-                            namehash = {}
-                            valuearray = []
-                            for allele in observedarray: #iterate through the alleles in the observed array
-                                for point in datapoints: #iterate throught the datapoints
-                                    for population in populations: #iterate through the populations
-                                        try: #use this try/except stack to build up a hash containing all of our frequency values. The value for each one will be its position in a list containing only location values
-                                            namehash[allele][point][population] = i
-                                        except KeyError:
-                                            try:  #we do this if we get a key error indicating that we don't yet have a hash declared for the datapoint
-                                                namehash[allele][point] = {}
-                                                namehash[allele][point][population] = i
-                                            except KeyError: #and we do this if we still get a key error, indicating that we don't have a hash declared for the allele itself
-                                                try:
-                                                    namehash[allele] = {}
-                                                    namehash[allele][point] = {}
-                                                    namehash[allele][point][population] = i
-                                                except:
-                                                    print('This is what you get for not making the data structure simpler')
-                                        namelist.append([allele, point, population])  #add to the list of field names
-                                        if point == 'AF':  #if we are analyzing allele frequency, that equates to the number of times seen in the population divided by the chromosomes counted for the population
-                                            try:
-                                                entry = int(frequencyhash[allele]['AC'][population])/int(frequencyhash[allele]['AN'][population])
-                                            except KeyError:  #if we get a key error, that means that the allele is unique, so the frequency for it being seen is zero
-                                                entry = 0
-                                            except ZeroDivisionError:  #if we get a zero division error, that means the locus had no coverage in the population and we cannot make a call
-                                                entry = 'NA'
-                                        elif point == 'HOMOF':  #if we are analyzing homozygous frequency for the allele
-                                            if chromosome not in ('X','x','Y','y','MT','Mt','mt'): #first we check and make sure it's not a sex chromosome (due to issues with hemizogosity) or the mitochondrial DNA
-                                                try:
-                                                    entry = int(frequencyhash[allele]['Hom'][population])/(int(frequencyhash[allele]['AN'][population])/2)  #if it is an autosome, homozygosity frequency is estimated as homozygotes counted/(chromosomes/2)
-                                                except KeyError:  #if we get a key error (meaning the allele is not reported in exac), we assume the allele to be unique (or at least have zero frequency in this database) and have zero homozygotes
-                                                    entry = 0 
-                                                except ZeroDivisionError: #and if we get no coverage at the locus, we return NA
-                                                    entry = 'NA'
-                                            else:
-                                                entry = 'NA'  #we also return NA for non-autosomal variants here to avoid giving false information in the case of hemizygosity (GitHub currently reports that ExAC does not handle hemizygosity for sex chromosomes very well)
-                                        valuearray.append(entry)
-                                        i += 1
-                                    maximum = 0
-                                    namehash[allele][point]['max'] = i  #create an entry in the name hash for max (the maximum frequency in the populations)
-                                    namelist.append([allele, point, 'max']) #add this to the name list as well
-                                    for population in populations: #iterate throught the populations
-                                        if valuearray[namehash[allele][point][population]] != 'NA':  #if the value was not reported as NA (indicating no coverage)
-                                            if maximum < valuearray[namehash[allele][point][population]]: #if the current value being inspected is greater than the previous maximum
-                                                maximum = valuearray[namehash[allele][point][population]] #that value becomes the new maximum
-                                    valuearray.append(maximum) #after iterating through all populations, we have the maximum and that gets entered in the array of values
-                                    i += 1 #and we increment the index pointer to the next cell in the list
-                            if not singlenonref and not homozygousrare:  #if this allele is heterozygous for two non-reference alleles
-                                allele1max = valuearray[namehash[observedarray[0]][point]['max']] #this just looks up the maximum frequency for allele 1
-                                allele2max = valuearray[namehash[observedarray[1]][point]['max']] #this does the same for allele 2
-                                rarestallele = min(int(allele1max),int(allele2max)) #this figures out which one is less
-                                if allele1max == 0:
-                                    allele1max = 1/65000    #this changes a zero value for these into 1/65000 to give us a more reasonable estimate of combination frequency (note that this will still treat a unique allele as being exceedingly rare)
-                                if allele2max == 0:
-                                    allele2max = 1/65000
-                                combomax = allele1max * allele2max
-                            elif singlenonref:
-                                rarestallele = valuearray[namehash[observedarray[0]]['AF']['max']]  #if only 1 allele was non-reference, we just use its value for the rarest and don't worry about the combo
-                                combomax = 'NA'
-                            elif homozygousrare:
-                                rarestallele = valuearray[namehash[observedarray[0]]['AF']['max']]  #and if the person is homozygous for a non-reference allele, the expected frequency of the combination (a homozygote) would be the highest frequency squared
-                                if rarestallele == 0:
-                                    combomax = (1/65000) ** 2
-                                else:
-                                    combomax = rarestallele ** 2
-                            datastring = ''  #initialize an empty string for building our output line
-                            for i in range(0,headercolumns):  #iterate through headercolumns (we use an i and a range so we can have a pointer of our position).  We are only going to the end of our named columns from the header (some outputs have additional data at the end of the line in un-headed columns; we will get to those)
-                                if datastring:  #if there is already something written to the string, we add a delimiter before adding anything else
-                                    datastring += delimiter 
-                                if delimiter in linearray[i]:  #if the currently-used delimiter character is in the data we want to write (usually a comma in a CSV)
-                                    linearray[i] = '"' + linearray[i] + '"'  #we add quotes to the beginning and end of the value to make sure that it is kept together
-                                datastring += linearray[i]  #then add the value to the end of the string
-                            for value in valuearray: #now iterate through the new values we want to add and put those on the string (the string is already started, so we don't have to worry about not sticking on a delimiter before the first item)
-                                datastring += delimiter + str(value)
-                            if len(observedarray) == 1: #this is a little confusing, but if we only had a single non-reference allele, regardless of zygosity, we only have one set of frequencies to report.  This fills in the Allele 2 columns with NA
-                                for value in valuearray:
-                                    datastring += delimiter + 'NA'
-                                #if homozygousrare:  #if the allele is homozygous for a nonreference
-                                #    rarestallele = valuearray[namehash[observedarray[0]][point]['max']] #this just looks up the maximum frequency for allele 1
-                                #    combomax = rarestallele ** 2
-                                #elif singlenonref: #if the locus is heterozygous for reference and nonreference
-                                #    rarestallele = valuearray[namehash[observedarray[0]][point]['max']] #this just looks up the maximum frequency for allele 1
-                                #    combomax = 'NA'
-                            datastring += delimiter + str(rarestallele) + delimiter + str(combomax)  #add the values to the datastring for output
-                            for i in range (headercolumns, len(linearray)):  #iterate through the columns from the original annotation that came after the ones with headers (in other words, headerless columns at the end of the table)
-                                if delimiter in linearray[i]: #as before, if the element we want to add has our delimiter in it, we need to quote the element to keep it together
-                                    linearray[i] = '"' + linearray[i] + '"' 
-                                datastring += delimiter + linearray[i] #and then add it to the growing string for eventual output
-            if refmismatch or extraalleles: #This handles what to output if there was a problem with the line (reference mismatch or 3+ alleles).  We will fill in the values with a message indicating why we did not give a value
-                if extraalleles:
-                    fillin = 'Too many observed alleles'
-                if refmismatch: #if reference was mismatched between the exome data and the ExAC data, we want to tell if the values were swapped (indicating a likely common allele where the reference has changed between genome edits) or if the two were entirely different
-                    if refandaltswapped:
-                        fillin = 'Swapped reference and alternate alleles (likely common).'
+                        if not extraalleles: #if we did not get back an indication of three alleles or more at the locus
+                            homozygousrare = False #the subject is heterozygous at the locus for two non-reference alleles
+                if not extraalleles and len(observedarray) in range(1,3):
+                    extraalleles = False #one last check to make sure we don't have extra alleles
+                    if len(reflinearray) > 8 and isinstance(reflinearray[8], list):  #the library handed us the finished values for each allele already
+                        precomputed = reflinearray[8]
+                    elif len(reflinearray) > 8 and reflinearray[8].startswith('ExACto='):  #if the library was built with precomputed frequencies, we just look up each allele's values
+                        precomputed = parseprecomputed(reflinearray[8])
                     else:
-                        fillin = 'Mismatched reference'
-                datastring = ''
-                for i in range(0,headercolumns):
-                    if datastring:
-                        datastring += delimiter
-                    if delimiter in linearray[i]:
-                        linearray[i] = '"' + linearray[i] + '"'
-                    datastring += linearray[i]
-                for i in range(0,newcolumns):  #changed for number of columns added
-                    datastring += delimiter + fillin
-                for i in range (headercolumns, len(linearray)):
-                    if delimiter in linearray[i]:
-                        linearray[i] = '"' + linearray[i] + '"'
-                    datastring += delimiter + linearray[i]
-            elif not founddata:  #if we found no ExAC reference data, we treat the variant as unique and put out the appropriate values
-                datastring = ''
-                for i in range(0,headercolumns):
-                    if datastring:
-                        datastring += delimiter
-                    if delimiter in linearray[i]:
-                        linearray[i] = '"' + linearray[i] + '"'
-                    datastring += linearray[i]
-                for i in range(0,int((newcolumns-len(summarycolumns))/2)):  #we have to retype as int here because division forces the value to a float type, even though it should always be the division of an even number by 2
-                    datastring += delimiter + '0'
-                for i in range(0,int((newcolumns-len(summarycolumns))/2)):
-                    datastring += delimiter + 'NA'
-                datastring += delimiter + '0'
-                datastring += delimiter + str(float((1/65000)*(1/65000)))
-                for i in range (headercolumns, len(linearray)):
-                    if delimiter in linearray[i]:
-                        linearray[i] = '"' + linearray[i] + '"'
-                    datastring += delimiter + linearray[i]
-        else: #this is what we do if the current line being annotated is the same base as the last line (meaning we can skip over finding the data for it again)
-            repeatlines += 1 #add one to the number of repeated lines we ran
-            datastring = datastring.strip('\n')  #take the previous iteration's datastring and remove the end of line on the end
-            datastringarray = datastring.split(delimiter) #split the datastring back into a table on the delimiter
-            linearrayindex = 0  #this keeps track of where in the linearray we are looking
-            for i in range (0,len(datastringarray)): #iterate through the datastring array
-                if i < headercolumns or i >= headercolumns + newcolumns: #indexing here depends on how many columns we add, double check if problems #if we are looking at a column that was not generated by this program (since values generated here will not change for different transcripts of the same gene, and it saves time not to calculate them again), change each value in the data string array to reflect the current line (most of these will actually remain the same, except for things pertaining to the specific transcript)
-                    datastringarray[i] = linearray[linearrayindex]
-                    linearrayindex += 1 #increment the counter so we know we are
-            datastring = '' #reinitialize the datastring (which is still going to contain the last iteration's data)
-            for datum in datastringarray:  #then iterate through our datastringarray with some new values from the currentline and form a new datastring to output
-                if datastring:
-                    datastring += delimiter
-                if delimiter in datum:
-                    datum = '"' + datum + '"'
-                datastring += datum
-        datastring += '\n' #and cap off the string with an end of line
-        try:
-            outputfile.write(datastring) #and, regardless of which statement was used to write the datastring (new line or repeat line), we write it to the output file
-        except:
-            quit('Error writing to output file.')
-        lastchromosome = chromosome  #these values remember this iteration's important information so that we can check next time to see if this is a repeat line or a new one
-        lastposition = position
-        lastreference = reference
-        lastobserved = observed
+                        precomputed = False
+                    for allele in (observedarray): #go through each of the observed alleles
+                        if precomputed and allele in exacalthash:
+                            allelevalues[allele] = precomputed[exacalthash[allele]]
+                            continue
+                        try: #use these try/except statements to build a frequency hash for each allele (the frequency hash data structure is better explained in the getfrequencyhash subroutine)
+                            frequencyhash[allele] = getfrequencyhash(reflinearray[7], populations, exacalthash[allele])  #the frequency hash for each allele is set to the returned value (a hash of hashes itself) from the getfrequencyhash subroutine
+                        except KeyError:  #if it returns a keyerror (because the hash of alternate alleles observed for ExAC did not list this allele), then this variant is unique and we need a hash full of zeroes for the frequency (and ones for the chromosome count, to avoid divisio by zero)
+                            frequencyhash[allele] = createzerohash(populations)
+                        allelevalues[allele] = getallelevalues(frequencyhash[allele], chromosome, datapoints, populations)  #turns the counts into the frequencies and maximums we output
+                else:
+                    state['messages'].append('Possible error on line ' + str(linenumber) + ', subject appears to have more than 2 alleles.') #if we hit this statement because there were extra alleles on the line (more than 2)
+                    extraalleles = True #set this value (which should already be set)
+                if not extraalleles: #otherwise, we continue the analysis
+                    valuearray = []
+                    for allele in observedarray: #the values for each allele go on the output line one after the other
+                        valuearray += allelevalues[allele]
+                    point = datapoints[-1]  #the two non-reference allele case below has always compared the maximums for the last datapoint, this keeps it that way
+                    if not singlenonref and not homozygousrare:  #if this allele is heterozygous for two non-reference alleles
+                        allele1max = allelevalues[observedarray[0]][maxindex[point]] #this just looks up the maximum frequency for allele 1
+                        allele2max = allelevalues[observedarray[1]][maxindex[point]] #this does the same for allele 2
+                        rarestallele = min(int(allele1max),int(allele2max)) #this figures out which one is less
+                        if allele1max == 0:
+                            allele1max = 1/65000    #this changes a zero value for these into 1/65000 to give us a more reasonable estimate of combination frequency (note that this will still treat a unique allele as being exceedingly rare)
+                        if allele2max == 0:
+                            allele2max = 1/65000
+                        combomax = allele1max * allele2max
+                    elif singlenonref:
+                        rarestallele = allelevalues[observedarray[0]][maxindex['AF']]  #if only 1 allele was non-reference, we just use its value for the rarest and don't worry about the combo
+                        combomax = 'NA'
+                    elif homozygousrare:
+                        rarestallele = allelevalues[observedarray[0]][maxindex['AF']]  #and if the person is homozygous for a non-reference allele, the expected frequency of the combination (a homozygote) would be the highest frequency squared
+                        if rarestallele == 0:
+                            combomax = (1/65000) ** 2
+                        else:
+                            combomax = rarestallele ** 2
+                    segment = ''  #initialize an empty string for building the columns we add to the line (the columns from the input get put around it at the end)
+                    for value in valuearray: #now iterate through the new values we want to add and put those on the string (each one gets its delimiter in front, since they will follow the input's headed columns)
+                        segment += delimiter + str(value)
+                    if len(observedarray) == 1: #this is a little confusing, but if we only had a single non-reference allele, regardless of zygosity, we only have one set of frequencies to report.  This fills in the Allele 2 columns with NA
+                        for value in valuearray:
+                            segment += delimiter + 'NA'
+                        #if homozygousrare:  #if the allele is homozygous for a nonreference
+                        #    rarestallele = valuearray[namehash[observedarray[0]][point]['max']] #this just looks up the maximum frequency for allele 1
+                        #    combomax = rarestallele ** 2
+                        #elif singlenonref: #if the locus is heterozygous for reference and nonreference
+                        #    rarestallele = valuearray[namehash[observedarray[0]][point]['max']] #this just looks up the maximum frequency for allele 1
+                        #    combomax = 'NA'
+                    segment += delimiter + str(rarestallele) + delimiter + str(combomax)  #add the values to the segment for output
+        if refmismatch or extraalleles: #This handles what to output if there was a problem with the line (reference mismatch or 3+ alleles).  We will fill in the values with a message indicating why we did not give a value
+            if extraalleles:
+                fillin = 'Too many observed alleles'
+            if refmismatch: #if reference was mismatched between the exome data and the ExAC data, we want to tell if the values were swapped (indicating a likely common allele where the reference has changed between genome edits) or if the two were entirely different
+                if refandaltswapped:
+                    fillin = 'Swapped reference and alternate alleles (likely common).'
+                else:
+                    fillin = 'Mismatched reference'
+            segment = ''
+            for i in range(0,newcolumns):  #changed for number of columns added
+                segment += delimiter + fillin
+        elif not founddata:  #if we found no ExAC reference data, we treat the variant as unique and put out the appropriate values
+            segment = ''
+            for i in range(0,int((newcolumns-len(summarycolumns))/2)):  #we have to retype as int here because division forces the value to a float type, even though it should always be the division of an even number by 2
+                segment += delimiter + '0'
+            for i in range(0,int((newcolumns-len(summarycolumns))/2)):
+                segment += delimiter + 'NA'
+            segment += delimiter + '0'
+            segment += delimiter + str(float((1/65000)*(1/65000)))
+        warned = len(state['messages']) > messagecount
+        rememberlocus(state, settings, locus, segment, warned)
+        if state['diskcache'] and not warned:  #loci with warnings stay out of the annotation cache so that later runs warn about them too
+            addannotationcache(state['diskcache'], locus, segment, delimiter)
+    for i in range(0, len(linearray)):  #now put the line back together around the added columns.  The columns from the input go back in as they were (the headed ones before our columns and any headerless ones at the end of the line after them)
+        if delimiter in linearray[i]:  #if the currently-used delimiter character is in the data we want to write (usually a comma in a CSV)
+            linearray[i] = '"' + linearray[i] + '"'  #we add quotes to the beginning and end of the value to make sure that it is kept together
+    datastring = delimiter.join(linearray[:headercolumns]) + segment + ''.join([delimiter + value for value in linearray[headercolumns:]]) + '\n'  #and cap off the string with an end of line
+    state['segment'] = segment
+    state['lastlocus'] = locus  #this remembers this iteration's locus so that we can check next time to see if this is a repeat line or a new one
+    return datastring
+
+def rememberlocus(state, settings, locus, segment, warned):  #remembers the finished columns for a locus (and whether it came with a warning) in case it shows up again later, dropping the least recently used locus once we are holding too many
+    if not settings['memoloci']:
+        return
+    state['memo'][locus] = (segment, warned)
+    if len(state['memo']) > settings['memoloci']:
+        state['memo'].popitem(last = False)
+
+annotationworker = {}  #each worker process keeps its own open library and the settings for the file here (set up once when the process starts)
+
+def startannotationworker(directory, cacheblocks, cachemegabytes, exacvcf, lazyverify, warmprofile, sharedlibrary, settings):  #runs once in each worker process to open the library (and attach to the shared library or warm up its cache from a usage profile, if we were given them)
+    closedecompressionpipes()
+    annotationworker['libraryinfo'] = openlibrary(directory, cacheblocks, cachemegabytes, exacvcf, lazyverify)
+    if sharedlibrary:
+        attachsharedlibrary(annotationworker['libraryinfo'], sharedlibrary[0], sharedlibrary[1])
+    if warmprofile:
+        warmlibrary(annotationworker['libraryinfo'], warmprofile)
+    annotationworker['settings'] = settings
+    annotationworker['diskcache'] = False
+    if settings['annotationcache']:  #each worker needs its own connection to the annotation cache
+        annotationworker['diskcache'] = openannotationcache(settings['annotationcache'][0], settings['annotationcache'][1])
+
+def annotatechunk(firstlinenumber, lines, mergejoin):  #runs in a worker process: annotates a chunk of lines and returns the output lines, messages, and counts so the main process can put everything back in order
+    import os
+    import collections
+    if not 'memo' in annotationworker:
+        annotationworker['memo'] = collections.OrderedDict()
+    state = createannotationstate(mergejoin, annotationworker['memo'], annotationworker['diskcache'])  #every chunk starts fresh except for the memo of annotated loci, which this worker keeps for as long as it runs.  Chunks only break where the library block changes, so no run of repeated lines gets split between two of them
+    outputlines = []
+    messages = []
+    for i in range(0, len(lines)):
+        outputlines.append(annotateline(lines[i], firstlinenumber + i, annotationworker['settings'], annotationworker['libraryinfo'], state))
+        messages += state['messages']
+        state['messages'] = []
+    if annotationworker['diskcache']:
+        saveannotationcache(annotationworker['diskcache'])  #the other jobs sharing the cache can use these as soon as the chunk is done
+    usage = annotationworker['libraryinfo']['usage']  #the block usage is sent back a chunk at a time and added up by the main process
+    annotationworker['libraryinfo']['usage'] = {}
+    return (outputlines, messages, state['newlines'], state['repeatlines'], os.getpid(), cachecounts(annotationworker['libraryinfo']), usage, state['cachedlines'])  #the cache counts are running totals for this worker, so the main process just keeps the latest ones from each worker
+
+def parallelannotate(inputfile, outputfile, line, settings, libraryinfo, state, workers, chunklines = 2000):  #annotates the rest of the input file using a pool of worker processes.  The file is cut into chunks of about chunklines lines, but only where the library block changes, and the results are written back out in the original order.  Returns the combined block cache counts from the workers
+    import collections
+    import concurrent.futures
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers = workers, initializer = startannotationworker, initargs = (libraryinfo['directory'], libraryinfo['cache']['maxblocks'], libraryinfo['cache']['maxbytes'] // 1048576, libraryinfo['exacvcf'], libraryinfo['lazyverify'], libraryinfo['warmprofile'], libraryinfo['sharedlibrary'], settings))
+    pending = collections.deque()  #chunks that have been sent out, in the order they came from the file
+    workercache = {}  #latest cache totals from each worker process
+    linenumber = 0
+    chunk = []
+    chunkstart = 1
+    lastblock = False
+    print ('Annotating with ' + str(workers) + ' worker processes.')
+    while line or chunk:
+        block = False
+        locus = lineposition(line, settings)  #work out which library block this line needs so we know if we can break the chunk here
+        if locus:
+            chromosome, position = locus
+            block = libraryblockname(chromosome, position)
+        if chunk and (not line or (len(chunk) >= chunklines and block and block != lastblock)):  #send off the chunk once it is big enough and we are moving to a new block (or at the end of the file)
+            pending.append(pool.submit(annotatechunk, chunkstart, chunk, state['mergejoin']))
+            chunk = []
+            chunkstart = linenumber + 1
+            while len(pending) > workers * 2 or (not line and pending):  #keep a few chunks queued up for each worker, but don't read the whole file into memory.  At the end of the file, we collect everything that is left
+                writeannotatedchunk(pending.popleft().result(), outputfile, state, workercache, libraryinfo['usage'])
+        if not line:
+            break
+        linenumber += 1
+        chunk.append(line)
+        if block:
+            lastblock = block
+            if state['mergejoin'] and not checksortorder(state, chromosome, int(position)):  #the main process keeps track of the sort order for the whole file, since each chunk only sees its own part
+                print('Input does not appear to be sorted by chromosome and position at line ' + str(linenumber) + '.  Switching to random access library lookups.')
         try:
-            line = inputfile.readline()  #then we read a new line from the input file (if it reads blank becaue it's the end of the file, the loop will exit)
+            line = inputfile.readline()
         except:
             quit('Error reading from input file.')
-    print ('Annotated ' + str(newlines) + ' unique loci and ' + str(repeatlines) + ' duplicated lines.' )  #Tells the user a summary of what was done.
-    #reflineout.close()  #debugging only
+    pool.shutdown()
+    cachetotals = [0, 0, 0, 0, 0]
+    for counts in workercache.values():  #add up the cache totals from all the workers for the report at the end
+        for i in range(0, len(counts)):
+            cachetotals[i] += counts[i]
+    return cachetotals
+
+def writeannotatedchunk(result, outputfile, state, workercache, usage):  #writes the output lines from a finished chunk and adds its counts to the totals
+    outputlines, messages, newlines, repeatlines, workerid, cachecounts, chunkusage, cachedlines = result
+    for blockname in chunkusage:
+        usage[blockname] = usage.get(blockname, 0) + chunkusage[blockname]
+    for message in messages:
+        print(message)
+    try:
+        outputfile.write(''.join(outputlines))
+    except:
+        quit('Error writing to output file.')
+    state['newlines'] += newlines
+    state['repeatlines'] += repeatlines
+    state['cachedlines'] += cachedlines
+    workercache[workerid] = cachecounts
+    print ('Processed ' + str(state['newlines'] + state['repeatlines']) + ' lines.', end = '\r')
+
+def createannotationstate(mergejoin = True, memo = False, diskcache = False):  #creates the dictionary of values that annotateline needs to carry from one line to the next.  A memo of annotated loci can be given to carry it over from an earlier state, and an open annotation cache to check before the library
+    import collections
+    state = {'lastlocus':False, 'segment':'', 'newlines':0, 'repeatlines':0, 'cachedlines':0, 'messages':[], 'lastlibraryfile':False, 'library':False}  #the last locus and the columns we added for it for handling repeated lines, counters, and the last block used for random access lookups
+    if memo is False:
+        memo = collections.OrderedDict()
+    state['memo'] = memo  #the added columns for loci we have already annotated, oldest use first, so repeats anywhere in the file can skip straight to output
+    state['diskcache'] = diskcache
+    state['mergejoin'] = mergejoin  #we start out assuming the input is sorted by chromosome and position so we can walk forward through the library with a single cursor.  If the order ever breaks, we fall back to looking up each locus on its own
+    state['mergecursor'] = {'block':False, 'library':False, 'index':0}  #where the library cursor currently sits: the block it is in, that block's position index, and the line it is pointing at
+    state['mergechromosome'] = False
+    state['mergeposition'] = 0
+    state['mergedchromosomes'] = set()  #chromosomes we have already walked through (if one shows up again, the input is not sorted)
+    return state
+
+def checksortorder(state, chromosome, position):  #keeps track of whether loci are coming in sorted by chromosome and position.  Returns False (and turns off mergejoin in the state) the first time the order breaks
+    if (chromosome == state['mergechromosome'] and position < state['mergeposition']) or (chromosome != state['mergechromosome'] and chromosome in state['mergedchromosomes']):  #going backwards on a chromosome or coming back to one we already finished means the input is not sorted
+        state['mergejoin'] = False
+        return False
+    state['mergedchromosomes'].add(chromosome)
+    state['mergechromosome'] = chromosome
+    state['mergeposition'] = position
+    return True
+
+def lineposition(line, settings):  #pulls the chromosome (without any chr in front) and position out of an input line, or returns False for comment lines
+    import re
+    if not line or line[0] == '#':
+        return False
+    if settings['fileformat'] == 'tdt':
+        linearray = line.strip('\r\n').split('\t')
+    else:
+        linearray = quotedsplit(line.strip('\r\n'))
+    return (re.sub('^chr', '', linearray[settings['chromosomecolumn']], flags=re.IGNORECASE), linearray[settings['positioncolumn']])
+
+def lineblockname(line, settings):  #the name of the library block an input line will need, or False for comment lines
+    locus = lineposition(line, settings)
+    if not locus:
+        return False
+    return libraryblockname(locus[0], locus[1])
+
+def libraryblockname(chromosome, position):  #the name of the library block holding a chromosome and position
+    return str(chromosome) + 'c' + str(int(position) - (int(position) % libraryblocksize)) + '.subvcf'
 
 def main():
     import time  #this module lets us determine how long the run took (it is used only once at the very start and once at the very end of the program)
     starttime = time.time() #mark the start time
-    print('          ***IMPORTANT***\nIF YOU ARE USING THE LIBRARY SPLIT FROM A PREVIOUS VERSION OF THIS PROGRAM \(BEFORE 0.8.7.1\), YOU WILL NEED TO REDO THE SPLIT.  THE BLOCK SIZE HAS CHANGED.\n')
     job = checkargs() #make sure the commandline arguments were valid, if they were not, this subroutine will exit the program
     file = job[0] 
     jobtype = job[1]
+    args = job[2]
+    if jobtype == 'annotate' and not args.exacvcf:  #the manifest tells us if the library was split with a different block size, so we only need the warning for libraries too old to have one
+        checklibraryversion('subvcfs')
     if jobtype == 'librarysplit':  #this if/elseif statement will tell the program to either generate a library or annotate a file passed in the argument
-        if not librarysplit(file):
+        if not librarysplit(file, args.packed, args.precompute, args.slim, args.workers, args.sqlite, args.numpy, args.binary, args.bloom):
             quit('Error creating checksum hash for library.')
     elif jobtype == 'annotate':
-        annotate(file)
+        annotate(file, args.cacheblocks, args.cachemegabytes, args.workers, args.exacvcf, args.verify, args.lazyverify, args.prefetch, args.profile, args.warm, args.sharedlibrary, args.batchlines, args.queuebatches, args.flushbatches, args.memoloci, args.annotationcache, args.purgecache)
     print ('Job completed successfully in ' + str(round(time.time() - starttime, 1)) + ' seconds.') #report back to the user how long this all took
     
-main()
+if __name__ == '__main__':  #keeps worker processes from rerunning the whole program when they load this file
+    main()
     
\ No newline at end of file